@@ -0,0 +1,184 @@
+import itertools
+import queue
+import threading
+from concurrent.futures import Future
+
+from setpoints import SetpointManager
+
+# Priorities of the bus queue - lower numbers go on the wire first
+EMERGENCY = 0
+SETPOINT = 1
+READ = 2
+INFO = 3
+
+
+class MFCBus(threading.Thread):
+    """
+    Owns the serial line of an MFC connection. Every transaction is put in a priority queue
+    and executed on this thread, so the GUI never waits for the bus and commands from
+    different callers can never interleave on the wire.
+    Each submitted command returns a concurrent.futures.Future with the reply
+    """
+    def __init__(self, mfc):
+        super(MFCBus, self).__init__(daemon=True)
+        self.mfc = mfc
+        self.queue = queue.PriorityQueue()
+
+        # Only touched from the bus thread
+        self.setpoints = SetpointManager(mfc)
+
+        # Keeps commands of the same priority in the order they were submitted
+        self._order = itertools.count()
+
+    def submit(self, func, *args, priority=READ, **kwargs):
+        future = Future()
+        self.queue.put((priority, next(self._order), future, func, args, kwargs))
+        return future
+
+    def run(self):
+        while True:
+            _, _, future, func, args, kwargs = self.queue.get()
+            if func is None:
+                break
+
+            if not future.set_running_or_notify_cancel():
+                continue
+
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+
+    def stop(self):
+        # Queued after everything else, so pending commands are still sent
+        self.queue.put((float('inf'), next(self._order), None, None, (), {}))
+
+    def set_flow(self, flow, addr):
+        return self.submit(self.mfc.set_flow, flow, addr, priority=SETPOINT)
+
+    def apply_setpoints(self, setpoints):
+        return self.submit(self.setpoints.apply, setpoints, priority=SETPOINT)
+
+    def zero_flows(self, addrs):
+        # The futures hold whether each device acknowledged
+        return [self.submit(self._zero_flow, addr, priority=EMERGENCY) for addr in addrs]
+
+    def _zero_flow(self, addr):
+        self.setpoints.forget(addr)
+        return self.mfc.zero_flow(addr)
+
+    def read_flow(self, addr, max_age=None):
+        return self.submit(self.mfc.read_flow, addr, max_age, priority=READ)
+
+    def information(self, addr):
+        return self.submit(self.mfc.information, addr, priority=INFO)
+
+    def negotiate_baud(self, addrs, baud):
+        return self.submit(self.mfc.negotiate_baud, addrs, baud, priority=SETPOINT)
+
+    def discover(self, addrs=range(1, 254), expected=None, timeout=0.02):
+        """
+        Sweeps the addresses for devices in the background. Every address is a separate low priority
+        job, so regular traffic goes on during the sweep. Stops early once expected devices answered.
+        Returns a future with a dict of device info (SN, FS and U) by address
+        """
+        result = Future()
+        addrs = list(addrs)
+        found = {}
+
+        def probe(i):
+            try:
+                if i == len(addrs) or (expected is not None and len(found) >= expected):
+                    result.set_result(found)
+                    return
+
+                if self.mfc.probe(addrs[i], timeout):
+                    # A regular SN? confirms the device - a late reply of another address can pass a probe
+                    info = self.mfc.device_info(addrs[i])
+                    if info['SN'] != 'N/A':
+                        found[addrs[i]] = info
+                self.submit(probe, i + 1, priority=INFO)
+            except Exception as e:
+                result.set_exception(e)
+
+        self.submit(probe, 0, priority=INFO)
+        return result
+
+
+class BusManager():
+    """
+    Maps every flow controller address to a serial port and runs one MFC connection and MFCBus
+    per port, so controllers on different adapters are polled at the same time.
+    mfc_factory is called with the port name, e.g. mks.MFC
+    """
+    def __init__(self, ports, mfc_factory):
+        self.ports = dict(ports)
+        self.buses = {}
+        for port in sorted(set(self.ports.values())):
+            bus = MFCBus(mfc_factory(port))
+            bus.start()
+            self.buses[port] = bus
+
+    def bus(self, addr):
+        return self.buses[self.ports[addr]]
+
+    def mfc(self, addr):
+        return self.bus(addr).mfc
+
+    def stop(self):
+        for bus in self.buses.values():
+            bus.stop()
+
+    def set_flow(self, flow, addr):
+        return self.bus(addr).set_flow(flow, addr)
+
+    def apply_setpoints(self, setpoints):
+        """
+        Writes the changed setpoints (dict of flows by address) on every bus.
+        Returns a dict of futures by port with the mismatches read back
+        """
+        futures = {}
+        for port, bus in self.buses.items():
+            port_setpoints = {addr: flow for addr, flow in setpoints.items() if self.ports[addr] == port}
+            if port_setpoints:
+                futures[port] = bus.apply_setpoints(port_setpoints)
+        return futures
+
+    def zero_flows(self, addrs):
+        return [future for addr in addrs for future in self.bus(addr).zero_flows([addr])]
+
+    def read_flow(self, addr, max_age=None):
+        return self.bus(addr).read_flow(addr, max_age)
+
+    def read_flows(self, addrs, max_age=None):
+        """
+        Queues a flow reading of every address at once - each bus works through its own share in parallel.
+        Returns a dict of futures by address
+        """
+        return {addr: self.read_flow(addr, max_age) for addr in addrs}
+
+    def information(self, addr):
+        return self.bus(addr).information(addr)
+
+    def discover(self, expected=True, timeout=0.02):
+        """
+        Sweeps every bus for devices. With expected set, a bus stops once it found as many devices
+        as are mapped to its port. Returns a dict of futures by port
+        """
+        futures = {}
+        for port, bus in self.buses.items():
+            n = len([addr for addr in self.ports if self.ports[addr] == port]) if expected else None
+            futures[port] = bus.discover(expected=n, timeout=timeout)
+        return futures
+
+    def negotiate_baud(self, baud):
+        """
+        Switches every bus to a new baud rate. Returns a dict of futures by port with the rate in use afterwards
+        """
+        futures = {}
+        for port, bus in self.buses.items():
+            addrs = [addr for addr, addr_port in self.ports.items() if addr_port == port]
+            futures[port] = bus.negotiate_baud(addrs, baud)
+        return futures
@@ -0,0 +1,103 @@
+import bisect
+import collections
+import threading
+import time
+
+from journal import NAK, TIMEOUT
+
+# Upper edges of the round-trip time buckets in ms - the last bucket holds everything slower
+BUCKETS_MS = (2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+
+class BusMetrics():
+    """
+    Low-overhead statistics of the transactions on one serial bus: round-trip time histograms per
+    address and command, bytes sent and received, timeouts, NAKs, and how much of the last
+    window seconds the bus was busy
+    """
+    def __init__(self, window=60.0, buckets=BUCKETS_MS):
+        self.window = window
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.histograms = collections.defaultdict(lambda: [0]*(len(self.buckets) + 1))
+            self.bytes_sent = 0
+            self.bytes_received = 0
+            self.timeouts = 0
+            self.naks = 0
+            self.started = time.monotonic()
+
+            # (end time, duration) of the transactions within the window
+            self.busy = collections.deque()
+            self.busy_time = 0
+
+    def received(self, n):
+        with self.lock:
+            self.bytes_received += n
+
+    def record(self, addr, cmd, rtt, sent, status):
+        now = time.monotonic()
+        bucket = bisect.bisect_left(self.buckets, rtt*1000)
+
+        with self.lock:
+            self.histograms[(addr, cmd)][bucket] += 1
+            self.bytes_sent += sent
+            if status == TIMEOUT:
+                self.timeouts += 1
+            elif status == NAK:
+                self.naks += 1
+
+            self.busy.append((now, rtt))
+            self.busy_time += rtt
+            self._expire(now)
+
+    def _expire(self, now):
+        while self.busy and self.busy[0][0] < now - self.window:
+            self.busy_time -= self.busy.popleft()[1]
+
+    def occupancy(self):
+        """
+        Percentage of the sliding window the bus spent in transactions
+        """
+        now = time.monotonic()
+        with self.lock:
+            self._expire(now)
+            span = min(self.window, now - self.started)
+            return 100 * self.busy_time / span if span > 0 else 0
+
+    def histogram(self, addr=None, cmd=None):
+        """
+        Bucket counts summed over the matching addresses and commands
+        """
+        counts = [0]*(len(self.buckets) + 1)
+        with self.lock:
+            for (h_addr, h_cmd), h_counts in self.histograms.items():
+                if (addr is None or h_addr == addr) and (cmd is None or h_cmd == cmd):
+                    counts = [a + b for a, b in zip(counts, h_counts)]
+        return counts
+
+    def snapshot(self):
+        occupancy = self.occupancy()
+        with self.lock:
+            return {'histograms': {key: list(counts) for key, counts in self.histograms.items()},
+                    'bytes_sent': self.bytes_sent, 'bytes_received': self.bytes_received,
+                    'timeouts': self.timeouts, 'naks': self.naks, 'occupancy': occupancy}
+
+    def report(self):
+        """
+        Plain text summary, as shown in the bus statistics dialog
+        """
+        snapshot = self.snapshot()
+        labels = [f'<{edge}' for edge in self.buckets] + [f'>{self.buckets[-1]}']
+
+        lines = [f"Bus occupancy (last {self.window:.0f} s): {snapshot['occupancy']:.1f} %",
+                 f"Sent: {snapshot['bytes_sent']} B   Received: {snapshot['bytes_received']} B",
+                 f"Timeouts: {snapshot['timeouts']}   NAKs: {snapshot['naks']}",
+                 '',
+                 'Round trip [ms]  ' + ' '.join([f'{label:>6s}' for label in labels])]
+        for (addr, cmd), counts in sorted(snapshot['histograms'].items()):
+            lines.append(f'{addr:03d} {cmd:4s}         ' + ' '.join([f'{n:6d}' for n in counts]))
+        return '\n'.join(lines)
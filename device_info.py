@@ -0,0 +1,67 @@
+import json
+import os
+import threading
+
+
+class DeviceInfoCache():
+    """
+    Keeps the static properties of the mass flow controllers (serial number, full scale and units)
+    keyed by address and persisted to a json file, so they don't have to be asked for on every
+    setpoint or at every startup
+    """
+    def __init__(self, path='mfc_info.json'):
+        self.path = path
+        self.lock = threading.Lock()
+        self.devices = {}
+
+        if path is not None and os.path.exists(path):
+            try:
+                with open(path, 'r') as f:
+                    self.devices = json.load(f)
+            except (OSError, ValueError):
+                # A broken cache file is just treated as empty
+                self.devices = {}
+
+    def get(self, addr):
+        with self.lock:
+            info = self.devices.get(str(addr))
+            return dict(info) if info is not None else None
+
+    def set(self, addr, info):
+        with self.lock:
+            self.devices[str(addr)] = dict(info)
+            self.save()
+
+    def invalidate(self, addr=None):
+        """
+        Forgets a single device or, if no address is given, every device
+        """
+        with self.lock:
+            if addr is None:
+                self.devices.clear()
+            else:
+                self.devices.pop(str(addr), None)
+            self.save()
+
+    def save(self):
+        if self.path is None:
+            return
+
+        # Write to a temporary file first so a crash never leaves half a cache behind
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.devices, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+def get_cache(path='mfc_info.json'):
+    """
+    Returns the cache of a file, so several MFC connections never overwrite each other's devices
+    """
+    with _caches_lock:
+        if path not in _caches:
+            _caches[path] = DeviceInfoCache(path)
+        return _caches[path]
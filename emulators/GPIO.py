@@ -1,7 +1,7 @@
 def setmode(input):
     print(f'Set mode to {input}')
 
-def setup(pins, mode):
+def setup(pins, mode, pull_up_down=None):
     print(f'Setup pins {pins} to {mode}')
 
 def output(pins, level):
@@ -10,5 +10,32 @@ def output(pins, level):
 def input(pin):
     return True
 
+# Edge callbacks by pin - fired by trigger()
+_callbacks = {}
+
+def add_event_detect(pin, edge, callback=None, bouncetime=None):
+    print(f'Edge detection {edge} on pin {pin}')
+    _callbacks[pin] = callback
+
+def remove_event_detect(pin):
+    _callbacks.pop(pin, None)
+
+def trigger(pin):
+    """
+    Simulates an edge on an input pin, e.g. DRDY of an emulated thermocouple chip
+    """
+    callback = _callbacks.get(pin)
+    if callback is not None:
+        callback(pin)
+
 LOW = 0
 HIGH = 1
+
+OUT = 0
+IN = 1
+BCM = 11
+PUD_DOWN = 21
+PUD_UP = 22
+RISING = 31
+FALLING = 32
+BOTH = 33
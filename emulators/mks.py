@@ -1,8 +1,18 @@
 import random
 
+from retry_policy import RetryPolicy
+from readings import get_reading_cache
+from bus_metrics import BusMetrics
+from journal import command_code, ACK
+
 class MFC:
-    def __init__(self):
-        pass
+    def __init__(self, port='/dev/ttyUSB0', baud=9600, **kwargs):
+        self.port = port
+        self.baud = baud
+        self.setpoints = {}
+        self.retry_policy = RetryPolicy()
+        self.readings = get_reading_cache()
+        self.metrics = BusMetrics()
 
     def checksum(self, msg):
         decimal = sum([ord(s) for s in msg])
@@ -17,6 +27,10 @@ class MFC:
         final_msg = "@@" + msg + check
 
         print(f'{addr}:\t{final_msg}')
+        self.metrics.record(addr, command_code(cmd), 0, len(final_msg), ACK)
+
+        if cmd == 'SX?':
+            return '%.2f' % self.setpoints.get(addr, 0)
 
     def set_flow(self, flow, addr):
         """
@@ -25,10 +39,45 @@ class MFC:
         """
 
         self.comm('SX!%f' % flow, addr)
+        self.setpoints[addr] = flow
+
+    def zero_flow(self, addr):
+        self.comm('SX!%f' % 0, addr)
+        self.setpoints[addr] = 0
+        return True
+
+    def full_scale(self, addr):
+        return 10.0
+
+    def write_burst(self, frames, cmd):
+        replies = {}
+        for addr, frame in frames.items():
+            print(f'{addr}:\t{frame.decode()}')
+            replies[addr] = frame[9:frame.index(b';')].decode()
+            self.setpoints[addr] = float(replies[addr])
+        return replies, 0.0
+
+    def read_flow(self, addr, max_age=None):
+        if max_age is not None:
+            reading = self.readings.get(addr, max_age)
+            if reading is not None:
+                return reading[0]
 
-    def read_flow(self, addr):
         self.comm('FX?', addr)
-        return random.random()*10
+        flow = random.random()*10
+        self.readings.publish(addr, flow)
+        return flow
+
+    def negotiate_baud(self, addrs, baud):
+        print(f'{self.port}:\tSwitched {addrs} to {baud} baud')
+        self.baud = baud
+        return baud
+
+    def probe(self, addr, timeout=0.02):
+        return 230 <= addr <= 234
+
+    def device_info(self, addr, refresh=False):
+        return {'SN': f'EMU{addr}', 'FS': '10.00', 'U': 'SCCM'}
 
     def information(self, addr):
         return f'Random info about {addr}'
\ No newline at end of file
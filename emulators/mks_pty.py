@@ -0,0 +1,226 @@
+"""
+Simulated MKS bus on a Linux pseudo-terminal.
+
+Unlike emulators/mks.py, which replaces the MFC class, this speaks the @@@<addr><cmd>;<checksum>
+protocol on a pty, so the real mks.MFC can be pointed at the slave device and exercised end to end:
+
+    python -m emulators.mks_pty --devices 230-234 --latency 0.01 --jitter 0.003 --nak-rate 0.01
+    python -m emulators.mks_pty --bench 200
+"""
+import argparse
+import math
+import os
+import random
+import re
+import select
+import threading
+import time
+import tty
+
+FRAME = re.compile(rb'@@@(\d{3})([^;]*);([0-9A-Fa-f]{2})')
+
+
+def checksum(body):
+    return b'%02X' % (sum(body) & 0xFF)
+
+
+class VirtualMFC():
+    """
+    A flow controller whose flow follows the setpoint as a first-order lag with some noise
+    """
+    def __init__(self, addr, full_scale=10.0, units='SCCM', serial_number=None, time_constant=0.5, noise=0.005):
+        self.addr = addr
+        self.full_scale = full_scale
+        self.units = units
+        self.serial_number = serial_number or f'SIM{addr:05d}'
+        self.time_constant = time_constant
+        self.noise = noise
+        self.baud = 9600
+
+        self.setpoint = 0.0
+        self.flow = 0.0
+        self.updated = time.monotonic()
+
+    def update(self):
+        now = time.monotonic()
+        dt, self.updated = now - self.updated, now
+        self.flow += (self.setpoint - self.flow) * (1 - math.exp(-dt / self.time_constant))
+
+    def read_flow(self):
+        self.update()
+        return max(0.0, self.flow + random.gauss(0, self.noise * self.full_scale))
+
+    def handle(self, cmd):
+        """
+        Returns (ACK or NAK, value) for a command
+        """
+        if cmd == 'FX?':
+            return 'ACK', '%.3f' % self.read_flow()
+        if cmd == 'FS?':
+            return 'ACK', '%.2f' % self.full_scale
+        if cmd == 'U?':
+            return 'ACK', self.units
+        if cmd == 'SN?':
+            return 'ACK', self.serial_number
+        if cmd == 'SX?':
+            return 'ACK', '%.2f' % self.setpoint
+        if cmd == 'BR?':
+            return 'ACK', str(self.baud)
+
+        if cmd.startswith('SX!'):
+            try:
+                setpoint = float(cmd[3:])
+            except ValueError:
+                return 'NAK', '12'
+            if not 0 <= setpoint <= self.full_scale:
+                return 'NAK', '25'
+            self.update()
+            self.setpoint = setpoint
+            return 'ACK', '%.2f' % setpoint
+
+        if cmd.startswith('BR!'):
+            # A pty has no real baud rate - the value is only remembered
+            self.baud = int(cmd[3:])
+            return 'ACK', cmd[3:]
+
+        return 'NAK', '17'
+
+
+class MKSSimulator(threading.Thread):
+    """
+    Answers MKS frames on a pseudo-terminal for any number of virtual devices.
+    Every reply is delayed by latency +- jitter seconds, and with probability nak_rate a
+    NAK with nak_code is sent instead of the real answer. Open self.port with mks.MFC
+    """
+    def __init__(self, devices=None, latency=0.005, jitter=0.0, nak_rate=0.0, nak_code='01'):
+        super(MKSSimulator, self).__init__(daemon=True)
+        if devices is None:
+            devices = [VirtualMFC(addr) for addr in range(230, 235)]
+        self.devices = {device.addr: device for device in devices}
+
+        self.latency = latency
+        self.jitter = jitter
+        self.nak_rate = nak_rate
+        self.nak_code = nak_code
+
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+
+        self.frames = 0
+        self._running = threading.Event()
+        self._running.set()
+
+    def stop(self):
+        self._running.clear()
+        self.join()
+        os.close(self.master)
+        os.close(self.slave)
+
+    def run(self):
+        buffer = b''
+        while self._running.is_set():
+            ready, _, _ = select.select([self.master], [], [], 0.1)
+            if not ready:
+                continue
+
+            buffer += os.read(self.master, 1024)
+            while True:
+                match = FRAME.search(buffer)
+                if match is None:
+                    # Keep a possibly incomplete frame
+                    start = buffer.rfind(b'@@@')
+                    buffer = buffer[start:] if start >= 0 else b''
+                    break
+
+                buffer = buffer[match.end():]
+                self.frames += 1
+                reply = self.reply(match)
+                if reply is not None:
+                    delay = self.latency + random.uniform(-self.jitter, self.jitter)
+                    if delay > 0:
+                        time.sleep(delay)
+                    os.write(self.master, reply)
+
+    def reply(self, match):
+        addr = int(match.group(1))
+        device = self.devices.get(addr)
+        if device is None:
+            return None
+
+        body = match.group(0)[2:-2]
+        if checksum(body) != match.group(3).upper():
+            status, value = 'NAK', '01'
+        elif random.random() < self.nak_rate:
+            status, value = 'NAK', self.nak_code
+        else:
+            status, value = device.handle(match.group(2).decode('ascii', errors='replace'))
+
+        body = b'@000' + status.encode('ascii') + value.encode('ascii') + b';'
+        return b'@@' + body + checksum(body)
+
+
+def parse_devices(text):
+    # '230-234,240' -> [230, 231, 232, 233, 234, 240]
+    addrs = []
+    for part in text.split(','):
+        if '-' in part:
+            first, last = part.split('-')
+            addrs.extend(range(int(first), int(last) + 1))
+        else:
+            addrs.append(int(part))
+    return addrs
+
+
+def benchmark(simulator, cycles):
+    """
+    Polls every virtual device with the real mks.MFC and prints the round-trip statistics
+    """
+    from mks import MFC
+
+    m = MFC(simulator.port)
+    addrs = sorted(simulator.devices)
+
+    cycle_times = []
+    for _ in range(cycles):
+        start = time.perf_counter()
+        for addr in addrs:
+            m.read_flow(addr)
+        cycle_times.append(time.perf_counter() - start)
+
+    cycle_times.sort()
+    print(f'{cycles} cycles of {len(addrs)} FX? reads on {simulator.port}')
+    print(f'cycle time: median {1000*cycle_times[len(cycle_times)//2]:.2f} ms, '
+          f'95% {1000*cycle_times[int(0.95*(len(cycle_times) - 1))]:.2f} ms, max {1000*cycle_times[-1]:.2f} ms')
+    print(m.metrics.report())
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Simulated MKS flow controllers on a pseudo-terminal')
+    parser.add_argument('--devices', default='230-234', help='addresses, e.g. 230-234,240')
+    parser.add_argument('--latency', type=float, default=0.005, help='reply latency in s')
+    parser.add_argument('--jitter', type=float, default=0.0, help='latency jitter in s')
+    parser.add_argument('--nak-rate', type=float, default=0.0, help='probability of an injected NAK')
+    parser.add_argument('--nak-code', default='01')
+    parser.add_argument('--bench', type=int, metavar='CYCLES', help='benchmark mks.MFC against the simulator')
+    args = parser.parse_args()
+
+    devices = [VirtualMFC(addr) for addr in parse_devices(args.devices)]
+    simulator = MKSSimulator(devices, args.latency, args.jitter, args.nak_rate, args.nak_code)
+    simulator.start()
+
+    if args.bench:
+        benchmark(simulator, args.bench)
+        simulator.stop()
+        return
+
+    print(f'Simulating {sorted(simulator.devices)} on {simulator.port} - Ctrl+C to stop')
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        simulator.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,19 +1,61 @@
 import random
+import threading
+import time
+
+import numpy as np
+
+from emulators import GPIO
 
 class TC():
     """
     Class that handles the SPI driven thermocouple amplifier from Adafruit (MAX 31856)
     """
-    def __init__(self, CS_PINS, tc_type='N'):
+    def __init__(self, CS_PINS, tc_type='N', drdy_pins=None):
         print(f'Initialized TC on pin {CS_PINS}')
+        self.drdy_pins = drdy_pins
+        self._converting = threading.Event()
 
         self.tcs = [CS_PIN for CS_PIN in CS_PINS]
+        self.continuous = False
+        self.scan_time = None
+
     def __len__(self):
         return len(self.tcs)
 
     def initiate(self):
         pass
 
+    def start_continuous(self):
+        self.continuous = True
+
+        # Pulls the DRDY lines once per conversion, like the chips do
+        if self.drdy_pins:
+            self._converting.set()
+            threading.Thread(target=self._convert, daemon=True).start()
+
+    def stop_continuous(self):
+        self.continuous = False
+        self._converting.clear()
+
+    def _convert(self):
+        while self._converting.is_set():
+            time.sleep(self.conversion_time())
+            for pin in self.drdy_pins:
+                GPIO.trigger(pin)
+
+    def conversion_time(self):
+        return 0.0983
+
+    def scan(self):
+        self.scan_time = 0.0
+        return np.random.random(len(self))*100
+
+    def read_faults(self):
+        return np.zeros(len(self), dtype=np.uint8)
+
+    def read_T(self):
+        return self.scan()
+
     def get_T(self):
         # [tc.initiate_one_shot_measurement() for tc in self.tcs]
 
@@ -0,0 +1,52 @@
+import collections
+import threading
+import time
+
+# Bits of the MAX31856 fault status register - names as in adafruit_max31856.MAX31856.fault
+FAULT_BITS = {'cj_range': 0x80, 'tc_range': 0x40, 'cj_high': 0x20, 'cj_low': 0x10,
+              'tc_high': 0x08, 'tc_low': 0x04, 'voltage': 0x02, 'open_tc': 0x01}
+
+FaultEvent = collections.namedtuple('FaultEvent', ['t', 'channel', 'active', 'raised', 'cleared'])
+
+
+def decode_faults(status):
+    """
+    Returns the names of the faults set in a fault status register value
+    """
+    return {name for name, bit in FAULT_BITS.items() if status & bit}
+
+
+class FaultMonitor(threading.Thread):
+    """
+    Reads the fault status registers of all thermocouple chips every interval seconds, away from
+    the sampling path. callback(FaultEvent) is only called when the faults of a channel change
+    """
+    def __init__(self, tcs, callback, interval=5.0):
+        super(FaultMonitor, self).__init__(daemon=True)
+        self.tcs = tcs
+        self.callback = callback
+        self.interval = interval
+
+        self.faults = [set() for _ in range(len(tcs))]
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+    def check(self):
+        t = time.time()
+        for channel, status in enumerate(self.tcs.read_faults()):
+            active = decode_faults(int(status))
+            if active != self.faults[channel]:
+                event = FaultEvent(t, channel, active, active - self.faults[channel], self.faults[channel] - active)
+                self.faults[channel] = active
+                self.callback(event)
+
+    def run(self):
+        while not self._stop_event.is_set():
+            try:
+                self.check()
+            except Exception as e:
+                print(f'Reading thermocouple faults failed: {e}')
+            self._stop_event.wait(self.interval)
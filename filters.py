@@ -0,0 +1,57 @@
+import numpy as np
+
+
+class Decimator():
+    """
+    Streaming oversampling filter. Fast readings of all channels are collected in blocks of window
+    samples, and every block is reduced to one sample with NumPy: 'mean', 'median', or 'minmax'
+    (min and max of every channel). The standard deviation within the block is returned as well,
+    as a quality channel
+    """
+    methods = ('mean', 'median', 'minmax')
+
+    def __init__(self, window, channels, method='mean'):
+        if method not in self.methods:
+            raise ValueError(f'Unknown decimation method {method}')
+
+        self.window = window
+        self.channels = channels
+        self.method = method
+
+        # Readings of the block that is not complete yet
+        self.pending_t = np.empty(0)
+        self.pending = np.empty((0, channels))
+
+    def columns(self, names):
+        """
+        Names of the output columns for the given channel names
+        """
+        if self.method == 'minmax':
+            values = [f'{name} min' for name in names] + [f'{name} max' for name in names]
+        else:
+            values = list(names)
+        return values + [f'{name} std' for name in names]
+
+    def push(self, t, values):
+        """
+        Adds readings - t has shape (n,) and values (n, channels).
+        Returns (t, values, std) for all completed blocks, with one row per block
+        """
+        t = np.concatenate([self.pending_t, np.asarray(t, dtype=float)])
+        values = np.concatenate([self.pending, np.asarray(values, dtype=float).reshape(-1, self.channels)])
+
+        blocks = len(t) // self.window
+        n = blocks * self.window
+        self.pending_t, self.pending = t[n:], values[n:]
+
+        block_t = t[:n].reshape(blocks, self.window).mean(axis=1)
+        block = values[:n].reshape(blocks, self.window, self.channels)
+
+        if self.method == 'mean':
+            reduced = block.mean(axis=1)
+        elif self.method == 'median':
+            reduced = np.median(block, axis=1)
+        else:
+            reduced = np.concatenate([block.min(axis=1), block.max(axis=1)], axis=1)
+
+        return block_t, reduced, block.std(axis=1)
@@ -1,22 +1,52 @@
-import time
-
-
-def measure(filename, tcs):
-    start = time.time()
-    while (time.time() - start) < 60:
-
-        with open('running_flag', 'r') as f:
-            exp_running_flag = bool(int(f.read()))
-        if not exp_running_flag:
+from scheduler import FixedRateScheduler
+from writer import ChunkedWriter
+
+
+def measure(filename, sampler, session, header, decimator=None, rate=2.5, catch_up=False, duration=60,
+            chunk_bytes=50*1024*1024, chunk_seconds=3600):
+    """
+    Writes the sampler's readings until the session is stopped or duration seconds have passed
+    (None runs until stopped). The output is split into chunk files with a manifest next to them,
+    see writer.ChunkedWriter.
+    The loop runs at rate Hz on fixed deadlines (see scheduler.FixedRateScheduler) and missed
+    deadlines are reported when the measurement ends.
+    Without a decimator the latest sample is written on every tick, stamped with the tick's deadline
+    so rows are evenly spaced - the rate can't be higher than the sampler's. With a decimator every
+    new sample goes through it and the decimated rows with their standard deviations are written
+    """
+    if decimator is None and rate > 1 / sampler.period:
+        raise ValueError(f'Rate of {rate} Hz is above the {1 / sampler.period:.1f} Hz of the sampler')
+
+    scheduler = FixedRateScheduler(rate, catch_up, clock=sampler.clock)
+    with ChunkedWriter(filename, header, chunk_bytes, chunk_seconds) as writer:
+        result = _measure(filename, sampler, session, writer, decimator, scheduler, duration)
+
+    if scheduler.missed:
+        result += f' - {scheduler.missed} sampling deadlines missed'
+    return result
+
+
+def _measure(filename, sampler, session, writer, decimator, scheduler, duration):
+    clock = scheduler.clock
+    start = clock.monotonic()
+    count = sampler.buffer.count
+    while duration is None or (clock.monotonic() - start) < duration:
+
+        # Returns early when the measurement is stopped
+        if scheduler.wait(session):
             return f'<span style="color:red;">Measurement <span style="font-weight: 600;">{filename[:-4]}</span> stopped<span>'
 
-        temperatures = '\t'.join(list(map(str, tcs.get_T())))
-
-        output = f'{time.time()}\t'+temperatures
-
-        with open(filename, 'a') as file:
-            file.write(output + "\n")
-
-        time.sleep(0.4)
+        # Samples of the background sampler - no SPI traffic here
+        if decimator is None:
+            sample = sampler.latest()
+            if sample is None:
+                continue
+            rows = [[clock.wall(scheduler.deadline())] + list(sample[1])]
+        else:
+            t, T, count = sampler.since(count)
+            t, T, T_std = decimator.push(t, T)
+            rows = [[t[i]] + list(T[i]) + list(T_std[i]) for i in range(len(t))]
+
+        writer.write_rows(rows)
 
     return f'Measurement {filename[:-4]} finished'
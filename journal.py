@@ -0,0 +1,234 @@
+"""
+Append-only binary journal of every MFC transaction.
+
+Every session writes its own file per serial port in the journal directory. A file starts with a fixed header
+holding a wall-clock anchor for the monotonic clock, followed by fixed-size records:
+
+    t       float64   time.monotonic() when the request was sent
+    addr    uint16    device address
+    cmd     4 bytes   command code without arguments (FX?, SX!, ...)
+    rtt     float32   round-trip time in ms
+    status  uint8     ACK, NAK, TIMEOUT, CHECKSUM or GARBLED
+    code    uint8     NAK error code (0 otherwise)
+
+Transactions on a port are sent one after another, so timestamps only grow within a file and
+the files can be memory-mapped and searched by time.
+
+Query from the command line, e.g. all NAKs of address 233 in an afternoon:
+    python journal.py --addr 233 --status NAK --start "2026-10-18 12:00" --end "2026-10-18 18:00"
+"""
+import argparse
+import atexit
+import datetime
+import glob
+import os
+import struct
+import threading
+import time
+
+import numpy as np
+
+ACK = 0
+NAK = 1
+TIMEOUT = 2
+CHECKSUM = 3
+GARBLED = 4
+
+STATUS_NAMES = {ACK: 'ACK', NAK: 'NAK', TIMEOUT: 'TIMEOUT', CHECKSUM: 'CHECKSUM', GARBLED: 'GARBLED'}
+
+MAGIC = b'MKSJ'
+VERSION = 1
+# magic, version, record size, wall-clock anchor, monotonic anchor
+HEADER = struct.Struct('<4sHHdd')
+HEADER_SIZE = 32
+RECORD = struct.Struct('<dH4sfBB')
+RECORD_DTYPE = np.dtype([('t', '<f8'), ('addr', '<u2'), ('cmd', 'S4'), ('rtt', '<f4'),
+                         ('status', 'u1'), ('code', 'u1')])
+
+
+def command_code(cmd):
+    # 'SX!12.000000' -> 'SX!'
+    for i, c in enumerate(cmd):
+        if c in '?!':
+            return cmd[:i+1]
+    return cmd[:4]
+
+
+class Journal():
+    """
+    Writer for the transaction journal. Records are buffered in memory by the file object, so
+    appending a record costs little more than a struct.pack. The buffer is flushed every
+    flush_records records or flush_interval seconds, so a crash loses at most that much
+    """
+    def __init__(self, directory='journal', port=None, buffer_size=64*1024, flush_records=500, flush_interval=1.0):
+        os.makedirs(directory, exist_ok=True)
+        self.lock = threading.Lock()
+
+        wall, mono = time.time(), time.monotonic()
+        name = datetime.datetime.fromtimestamp(wall).strftime('%Y%m%d-%H%M%S') + f'-{os.getpid()}'
+        if port is not None:
+            # /dev/ttyUSB0 -> ttyUSB0
+            name += '-' + os.path.basename(port)
+        name += '.bin'
+        self.path = os.path.join(directory, name)
+
+        self.flush_records = flush_records
+        self.flush_interval = flush_interval
+        self.pending = 0
+
+        # The header is flushed at once, so readers never see a file without one
+        self.file = open(self.path, 'ab', buffering=buffer_size)
+        self.file.write(HEADER.pack(MAGIC, VERSION, RECORD.size, wall, mono).ljust(HEADER_SIZE, b'\0'))
+        self.file.flush()
+        self.last_flush = time.monotonic()
+
+    def append(self, t, addr, cmd, rtt, status, code=0):
+        record = RECORD.pack(t, addr, command_code(cmd).encode('ascii', errors='replace'), rtt * 1000, status, code)
+        with self.lock:
+            self.file.write(record)
+            self.pending += 1
+            if self.pending >= self.flush_records or time.monotonic() - self.last_flush >= self.flush_interval:
+                self._flush()
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def _flush(self):
+        self.file.flush()
+        self.pending = 0
+        self.last_flush = time.monotonic()
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+_journals = {}
+_journals_lock = threading.Lock()
+
+def get_journal(directory='journal', port=None):
+    """
+    Returns the open journal of a port. Every port gets its own file - the bus threads of different
+    ports append in parallel, so a shared file would not be in time order
+    """
+    key = (directory, port)
+    with _journals_lock:
+        if key not in _journals:
+            _journals[key] = Journal(directory, port)
+            atexit.register(_journals[key].close)
+        return _journals[key]
+
+
+class JournalFile():
+    """
+    Read-only memory-mapped view of one journal file. A file without a complete header (one that is
+    just being created, or left empty by a crash) has no records
+    """
+    def __init__(self, path):
+        self.path = path
+        if os.path.getsize(path) < HEADER_SIZE:
+            self.wall_anchor = self.mono_anchor = 0.0
+            self.records = np.zeros(0, dtype=RECORD_DTYPE)
+            return
+
+        with open(path, 'rb') as f:
+            magic, version, record_size, self.wall_anchor, self.mono_anchor = HEADER.unpack(f.read(HEADER.size))
+
+        if magic != MAGIC or record_size != RECORD_DTYPE.itemsize:
+            raise ValueError(f'{path} is not a journal file (version {VERSION})')
+
+        # A record that is still being written is left out
+        n = (os.path.getsize(path) - HEADER_SIZE) // RECORD_DTYPE.itemsize
+        if n > 0:
+            self.records = np.memmap(path, dtype=RECORD_DTYPE, mode='r', offset=HEADER_SIZE, shape=(n,))
+        else:
+            self.records = np.zeros(0, dtype=RECORD_DTYPE)
+
+    def wall_time(self, t):
+        return self.wall_anchor + (t - self.mono_anchor)
+
+    def bisect(self, t, side='left'):
+        """
+        Index where a monotonic time t would be inserted, like np.searchsorted. The time field is a
+        strided view that searchsorted would copy whole, so this only reads O(log n) records
+        """
+        lo, hi = 0, len(self.records)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            t_mid = self.records[mid]['t']
+            if t_mid < t or (side == 'right' and t_mid == t):
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def select(self, start=None, end=None, addr=None, status=None, cmd=None):
+        """
+        Returns the records between two wall-clock times (seconds since epoch) matching the filters
+        """
+        lo = 0 if start is None else self.bisect(start - self.wall_anchor + self.mono_anchor, 'left')
+        hi = len(self.records) if end is None else self.bisect(end - self.wall_anchor + self.mono_anchor, 'right')
+        records = self.records[lo:hi]
+
+        mask = np.ones(len(records), dtype=bool)
+        if addr is not None:
+            mask &= records['addr'] == addr
+        if status is not None:
+            mask &= records['status'] == status
+        if cmd is not None:
+            mask &= records['cmd'] == cmd.encode('ascii')
+        return records[mask]
+
+
+def query(directory='journal', start=None, end=None, addr=None, status=None, cmd=None):
+    """
+    Yields (JournalFile, records) for every journal file with matching records
+    """
+    for path in sorted(glob.glob(os.path.join(directory, '*.bin'))):
+        journal_file = JournalFile(path)
+        records = journal_file.select(start, end, addr, status, cmd)
+        if len(records):
+            yield journal_file, records
+
+
+def parse_time(text):
+    return datetime.datetime.fromisoformat(text).timestamp()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Query the MFC transaction journal')
+    parser.add_argument('--dir', default='journal', help='journal directory')
+    parser.add_argument('--start', type=parse_time, help='e.g. "2026-10-18 12:00:00"')
+    parser.add_argument('--end', type=parse_time)
+    parser.add_argument('--addr', type=int)
+    parser.add_argument('--status', choices=list(STATUS_NAMES.values()))
+    parser.add_argument('--cmd', help='command code, e.g. FX?')
+    parser.add_argument('--count', action='store_true', help='only print the number of matches')
+    args = parser.parse_args()
+
+    status = None
+    if args.status is not None:
+        status = {name: value for value, name in STATUS_NAMES.items()}[args.status]
+
+    total = 0
+    for journal_file, records in query(args.dir, args.start, args.end, args.addr, status, args.cmd):
+        total += len(records)
+        if args.count:
+            continue
+
+        for record in records:
+            stamp = datetime.datetime.fromtimestamp(journal_file.wall_time(record['t']))
+            line = '%s\t%03i\t%s\t%8.2f ms\t%s' % (stamp.isoformat(sep=' ', timespec='milliseconds'), record['addr'],
+                                               record['cmd'].decode('ascii'), record['rtt'],
+                                               STATUS_NAMES.get(int(record['status']), '?'))
+            if record['status'] == NAK:
+                line += ' %02i' % record['code']
+            print(line)
+
+    if args.count:
+        print(total)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+import atexit
+import gzip
+import os
+import queue
+import shutil
+import threading
+import time
+
+
+class LogSink(threading.Thread):
+    """
+    Writes log records from a bounded queue on a background thread, so callers never wait for the disk.
+    Records are written in batches and the file is rotated and gzipped when it exceeds max_bytes.
+    If the queue is full, records are dropped and counted instead of blocking the caller. A failed
+    write (full or missing disk) drops its batch and is counted in errors - the thread keeps running
+    """
+    def __init__(self, path='mfc.log', max_bytes=5*1024*1024, backups=5, queue_size=10000, batch_size=500):
+        super(LogSink, self).__init__(daemon=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.batch_size = batch_size
+
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.dropped = 0
+        self.errors = 0
+        self._reported_drops = 0
+        self._drop_lock = threading.Lock()
+
+    def write(self, msg, error=False):
+        try:
+            self.queue.put_nowait((time.time(), error, msg))
+        except queue.Full:
+            with self._drop_lock:
+                self.dropped += 1
+
+    def stop(self, timeout=5.0):
+        # A dead thread would never make room in the queue
+        if not self.is_alive():
+            return
+        try:
+            self.queue.put(None, timeout=timeout)
+        except queue.Full:
+            return
+        self.join(timeout)
+
+    def format(self, record):
+        t, error, msg = record
+        if isinstance(msg, bytes):
+            msg = msg.decode('ascii', errors='replace')
+        stamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(t))
+        if error:
+            return "ERROR " + stamp + " -- " + msg + "\n"
+        return stamp + " -- " + msg + "\n"
+
+    def run(self):
+        f = None
+        running = True
+        while running:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            if None in batch:
+                batch = batch[:batch.index(None)]
+                running = False
+
+            lines = [self.format(record) for record in batch]
+
+            if self.dropped != self._reported_drops:
+                lines.append(self.format((time.time(), True, f"{self.dropped - self._reported_drops} log records dropped")))
+                self._reported_drops = self.dropped
+
+            try:
+                if f is None:
+                    f = open(self.path, 'a')
+                f.write(''.join(lines))
+                f.flush()
+
+                if f.tell() > self.max_bytes:
+                    f.close()
+                    f = None
+                    self.rotate()
+            except OSError:
+                self.errors += 1
+                with self._drop_lock:
+                    self.dropped += len(batch)
+                f = self.close_file(f)
+
+        self.close_file(f)
+
+    def close_file(self, f):
+        # Returns None, so the file is opened again for the next batch
+        if f is not None:
+            try:
+                f.close()
+            except OSError:
+                self.errors += 1
+        return None
+
+    def rotate(self):
+        # mfc.log -> mfc.log.1.gz, mfc.log.1.gz -> mfc.log.2.gz and so on
+        for i in range(self.backups - 1, 0, -1):
+            src = f'{self.path}.{i}.gz'
+            if os.path.exists(src):
+                os.replace(src, f'{self.path}.{i+1}.gz')
+
+        with open(self.path, 'rb') as f_in, gzip.open(f'{self.path}.1.gz', 'wb') as f_out:
+            shutil.copyfileobj(f_in, f_out)
+        os.remove(self.path)
+
+
+_sinks = {}
+_sinks_lock = threading.Lock()
+
+def get_sink(path='mfc.log'):
+    """
+    Returns the running sink for a file, so several MFC connections share one writer.
+    The sink is stopped at exit, so records still queued are written
+    """
+    with _sinks_lock:
+        if path not in _sinks:
+            sink = LogSink(path)
+            sink.start()
+            atexit.register(sink.stop)
+            _sinks[path] = sink
+        return _sinks[path]
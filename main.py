@@ -9,10 +9,17 @@ import traceback
 import sys
 import ui.rsc
 import os
-import numpy as np
 import time
 
 from functions import measure
+from session import MeasurementSession
+from sampler import TCSampler, DrdySampler
+from fault_monitor import FaultMonitor
+from filters import Decimator
+from writer import read_manifest
+import runfile
+from bus import BusManager
+from mks_protocol import baud_rates
 
 # Initalize GPIO pins on raspberry pi
 try:
@@ -55,21 +62,71 @@ class GasControl(QtWidgets.QMainWindow):
 
         # Mass Flow controller settings
         self.flow_controllers ={
-            'Ar': {'addr': 231, 'flow_input': self.ar_flow_input, 'flow_read': self.ar_flow,'info': self.ar_info},
-            'H2': {'addr': 233, 'flow_input': self.h2_flow_input, 'flow_read': self.h2_flow,'info': self.h2_info},
-            'N2': {'addr': 232, 'flow_input': self.n2_flow_input, 'flow_read': self.n2_flow,'info': self.n2_info},
-            'NH3': {'addr': 234, 'flow_input': self.nh3_flow_input, 'flow_read': self.nh3_flow,'info': self.nh3_info},
-            'CO': {'addr': 230, 'flow_input': self.co_flow_input, 'flow_read': self.co_flow,'info': self.co_info},
+            'Ar': {'addr': 231, 'port': '/dev/ttyUSB0', 'flow_input': self.ar_flow_input, 'flow_read': self.ar_flow,'info': self.ar_info},
+            'H2': {'addr': 233, 'port': '/dev/ttyUSB0', 'flow_input': self.h2_flow_input, 'flow_read': self.h2_flow,'info': self.h2_info},
+            'N2': {'addr': 232, 'port': '/dev/ttyUSB0', 'flow_input': self.n2_flow_input, 'flow_read': self.n2_flow,'info': self.n2_info},
+            'NH3': {'addr': 234, 'port': '/dev/ttyUSB0', 'flow_input': self.nh3_flow_input, 'flow_read': self.nh3_flow,'info': self.nh3_info},
+            'CO': {'addr': 230, 'port': '/dev/ttyUSB0', 'flow_input': self.co_flow_input, 'flow_read': self.co_flow,'info': self.co_info},
         }
 
         # Thermocouple settings - should be implemented in GUI
-        self.tcs = TC(CS_PINS=['D20'], tc_type='N')
+        # drdy_pins are the GPIO pins wired to the DRDY outputs - None reads on a timer instead
+        self.tcs = TC(CS_PINS=['D20'], tc_type='N', drdy_pins=None)
 
-        self.m = MFC()
+        # Reads the thermocouples in the background - measurements only read its buffer
+        if self.tcs.drdy_pins:
+            self.sampler = DrdySampler(self.tcs, GPIO, self.tcs.drdy_pins)
+        else:
+            self.sampler = TCSampler(self.tcs)
+
+        # Readings are averaged over blocks of this many samples before they are written (None writes raw samples)
+        self.filter_window = 4
+        self.filter_method = 'mean'
+
+        # Rows are written at this rate on fixed deadlines - catch_up writes late rows at once instead of skipping them
+        self.sample_rate = 2.5
+        self.catch_up = False
+
+        # Measurement length in s (None runs until stopped) - the output is split into chunk files of
+        # at most chunk_bytes or chunk_seconds each
+        self.duration = None
+        self.chunk_bytes = 50*1024*1024
+        self.chunk_seconds = 3600
+        # 'run' writes memory-mapped binary run files (see runfile.py), 'tsv' tab-separated text
+        self.file_format = 'tsv'
+        self.sampler.start()
+
+        # Thermocouple faults are checked at a low rate and only reported when they change
+        self.tc_signals = TCSignals()
+        self.tc_signals.fault.connect(self.show_fault)
+        self.fault_monitor = FaultMonitor(self.tcs, self.tc_signals.fault.emit, interval=5.0)
+        self.fault_monitor.start()
+
+        # Serial settings - holds the baud rate of every port
+        ports = {mfc['addr']: mfc['port'] for mfc in self.flow_controllers.values()}
+        self.rs232options = RS232Options(sorted(set(ports.values())))
+        self.rs232options.baud_requested.connect(self.change_baud)
+
+        # One connection and bus thread per serial port - results come back as signals
+        self.bus = BusManager(ports, lambda port: MFC(port, baud=self.rs232options.baud(port)))
+        self.bus_signals = BusSignals()
+        self.bus_signals.flow.connect(self.show_flow)
+        self.bus_signals.info.connect(self.show_info)
+        self.bus_signals.baud.connect(self.show_baud)
+        self.bus_signals.setpoints.connect(self.show_setpoints)
+        self.bus_signals.discovered.connect(self.show_discovered)
+
+        # Flow labels are fed from the shared reading cache, whoever triggered the reading
+        for gas, mfc in self.flow_controllers.items():
+            self.bus.mfc(mfc['addr']).readings.subscribe(
+                lambda addr, flow, t, gas=gas: self.bus_signals.flow.emit(gas, flow), addrs=[mfc['addr']], max_age=1.0)
 
         # Multithread control
         self.threadpool = QtCore.QThreadPool()
 
+        # Run state of the measurement, shared with the measurement thread
+        self.session = MeasurementSession()
+
         # Maybe run on its own thread - not implemented!
         self.timer = QtCore.QTimer()
         self.timer.timeout.connect(self.update_flow)
@@ -87,10 +144,12 @@ class GasControl(QtWidgets.QMainWindow):
 
         # Menubar actions
         self.action_RS232_Settings.triggered.connect(self.open_rs232_options)
-        self.rs232options = RS232Options()
 
         self.actionUpdate_Values.triggered.connect(self.update_control)
 
+        self.bus_metrics = BusMetricsDialog(self.bus)
+        self.actionBus_Statistics.triggered.connect(self.bus_metrics.show)
+
 
         for gas_valve in self.gas_valves.values():
             btn, relay = gas_valve['button'], gas_valve['relay']
@@ -105,9 +164,13 @@ class GasControl(QtWidgets.QMainWindow):
         self.btn_bypass.clicked.connect(lambda: self.open_valves('bypass'))
 
         # Information about mass flow controllers
-        for mfc in self.flow_controllers.values():
-            addr, info = mfc['addr'], mfc['info']
-            info.setText(self.m.information(addr))
+        for gas, mfc in self.flow_controllers.items():
+            future = self.bus.information(mfc['addr'])
+            future.add_done_callback(lambda f, gas=gas: self.emit_result(f, self.bus_signals.info, gas))
+
+        # Looks for missing or swapped controllers in the background
+        for port, future in self.bus.discover().items():
+            future.add_done_callback(lambda f, port=port: self.emit_result(f, self.bus_signals.discovered, port))
 
         # Setting the flow from input fields
         self.pushButton_set_flows.clicked.connect(self.set_flow)
@@ -150,9 +213,25 @@ class GasControl(QtWidgets.QMainWindow):
         self.write_output(f'Valves have been opened through {path}')
 
     def set_flow(self):
-        for mfc in self.flow_controllers.values():
-            addr, flow_input = mfc['addr'], mfc['flow_input']
-            self.m.set_flow(flow_input.value(), addr)
+        # Only setpoints that changed are written and then read back
+        setpoints = {mfc['addr']: mfc['flow_input'].value() for mfc in self.flow_controllers.values()}
+        for port, future in self.bus.apply_setpoints(setpoints).items():
+            future.add_done_callback(lambda f, port=port: self.emit_result(f, self.bus_signals.setpoints, port))
+
+    def show_setpoints(self, port, result):
+        if result == 'N/A':
+            self.write_output(f'Setting flows on {port} failed', error_flag=True)
+            return
+
+        gases = {mfc['addr']: gas for gas, mfc in self.flow_controllers.items()}
+        for addr, (flow, reason) in result['invalid'].items():
+            self.write_output(f'{gases[addr]} flow of {flow} is {reason} - no flows changed on {port}', error_flag=True)
+
+        for addr, (flow, reply) in result['mismatches'].items():
+            self.write_output(f'{gases[addr]} setpoint is {reply} - expected {flow}', error_flag=True)
+
+        if result['skew']:
+            self.write_output(f'Flows set on {port} within {result["skew"]:.1f} ms')
 
     def update_control(self, checked):
         if not checked:
@@ -162,40 +241,91 @@ class GasControl(QtWidgets.QMainWindow):
 
     def update_flow(self):
         for mfc in self.flow_controllers.values():
-            addr, flow_read= mfc['addr'], mfc['flow_read']
-            flow = self.m.read_flow(addr)
-            flow_read.setText('<span style=" font-weight:600; color:#1fa208;">'+f'{flow}'+'</span>')
+            addr, controller = mfc['addr'], self.bus.mfc(mfc['addr'])
+
+            # Degraded controllers are only polled now and then, so they don't stall the bus
+            if not controller.retry_policy.should_poll(addr):
+                continue
+
+            # Readings reach the labels through the reading cache subscriptions
+            future = self.bus.read_flow(addr, max_age=controller.readings.max_age(addr))
+            future.add_done_callback(self.report_bus_error)
+
+    def report_bus_error(self, future):
+        error = future.exception()
+        if error is not None:
+            traceback.print_exception(type(error), error, error.__traceback__)
+
+    def emit_result(self, future, signal, gas):
+        # Runs on the bus thread - the signal hands the result over to the GUI thread
+        try:
+            result = future.result()
+        except Exception:
+            traceback.print_exc()
+            result = 'N/A'
+        signal.emit(gas, result)
+
+    def show_flow(self, gas, flow):
+        flow_read = self.flow_controllers[gas]['flow_read']
+        flow_read.setText('<span style=" font-weight:600; color:#1fa208;">'+f'{flow}'+'</span>')
+
+    def show_info(self, gas, info):
+        self.flow_controllers[gas]['info'].setText(info)
+
+    def show_discovered(self, port, found):
+        if found == 'N/A':
+            self.write_output(f'Searching for flow controllers on {port} failed', error_flag=True)
+            return
+
+        expected = {mfc['addr']: gas for gas, mfc in self.flow_controllers.items() if mfc['port'] == port}
+        for addr, gas in expected.items():
+            if addr not in found:
+                self.write_output(f'No {gas} flow controller found at address {addr} on {port}', error_flag=True)
+
+        for addr, info in found.items():
+            if addr not in expected:
+                self.write_output(f'Unknown flow controller at address {addr} on {port} '
+                                  f'(Serial No: #{info["SN"]}, Scale: 0-{info["FS"]} {info["U"]})', error_flag=True)
+
+    def change_baud(self, baud):
+        for port, future in self.bus.negotiate_baud(baud).items():
+            future.add_done_callback(lambda f, port=port: self.emit_result(f, self.bus_signals.baud, port))
+
+    def show_baud(self, port, baud):
+        if baud == 'N/A':
+            self.write_output(f'Baud rate change on {port} failed', error_flag=True)
+            return
+
+        self.rs232options.set_baud(port, baud)
+        self.write_output(f'{port} running at {baud} baud')
 
     def exp_done(self):
-        # self.exp_running_flag = False
-        with open('running_flag', 'w') as f:
-            f.write('0')
+        self.session.finish()
         self.plot_timer.stop()
 
     def start_measurement(self):
-        with open('running_flag', 'r') as f:
-            exp_running_flag = bool(int(f.read()))
-        if exp_running_flag:
+        if not self.session.start():
             self.write_output('Measurement already running', error_flag=True)
             return
 
         self.plot_timer.start(200)
 
-        # Uses external file to follow if experiment is running
-        with open('running_flag', 'w') as f:
-            f.write('1')
-
         # Setting up file
-        filename = self.filename_input.text() + '.txt'
-        header = 'Time [s]\t'
-        T_header = "\t".join(['T%i [degC]' % i for i in range(len(self.tcs))])
-        with open(filename, 'w') as file:
-            file.write(header+T_header + "\n")
+        filename = self.filename_input.text() + ('.run' if self.file_format == 'run' else '.txt')
+        names = ['T%i' % i for i in range(len(self.tcs))]
 
         # Parameters
+        decimator = None
+        if self.filter_window:
+            decimator = Decimator(self.filter_window, len(self.tcs), self.filter_method)
+            names = decimator.columns(names)
+
+        header = ['Time [s]'] + ['%s [degC]' % name for name in names]
 
         # Setting up thread and signals
-        worker = Worker(measure, filename=filename, tcs=self.tcs)
+        worker = Worker(measure, filename=filename, sampler=self.sampler, session=self.session, header=header,
+                        decimator=decimator, rate=self.sample_rate, catch_up=self.catch_up,
+                        duration=self.duration, chunk_bytes=self.chunk_bytes, chunk_seconds=self.chunk_seconds)
         worker.signals.result.connect(self.write_output)
         worker.signals.error.connect(
             lambda: self.write_output('Measurement Failed - See print output for more details', error_flag=True))
@@ -207,8 +337,13 @@ class GasControl(QtWidgets.QMainWindow):
         self.write_output(f'Measurement <span style="font-weight: 600;">{filename[:-4]}</span> started')
 
     def stop(self):
-        with open('running_flag', 'w') as f:
-            f.write('0')
+        self.session.stop()
+
+    def show_fault(self, event):
+        if event.raised:
+            self.write_output(f'T{event.channel} fault: {", ".join(sorted(event.raised))}', error_flag=True)
+        if event.cleared:
+            self.write_output(f'T{event.channel} fault cleared: {", ".join(sorted(event.cleared))}')
 
     def write_output(self, line, error_flag=False):
         line = datetime.today().strftime('%Y-%m-%d %H:%M:%S')+'  '+line
@@ -221,11 +356,25 @@ class GasControl(QtWidgets.QMainWindow):
     def open_rs232_options(self):
         self.rs232options.show()
 
-    def update_plot(self):
-        filename = self.filename_input.text() + '.txt'
+    def closeEvent(self, event):
+        self.bus.stop()
+        self.sampler.stop()
+        self.fault_monitor.stop()
+        super(GasControl, self).closeEvent(event)
 
+    def update_plot(self):
+        # Follows the chunk the measurement is writing
         try:
-            t, T1, T2 = np.loadtxt(filename, delimiter='\t', skiprows=1).T
+            filename = read_manifest(self.filename_input.text() + '.txt')['chunks'][-1]['path']
+            data = runfile.load(filename)
+
+            # A new file or chunk only holds the header until its first rows are flushed
+            if data.shape[0] == 0 or data.shape[1] < len(self.tcs) + 1:
+                return
+
+            # The first columns after time are the temperatures - std columns are not plotted
+            t = data[:, 0]
+            temperatures = [data[:, i+1] for i in range(len(self.tcs))]
         except Exception as e:
             print(e)
             return
@@ -233,13 +382,47 @@ class GasControl(QtWidgets.QMainWindow):
         ax = self.plot_area.canvas.axes
         ax.clear()
 
-        ax.plot(t, T1, 'o:', label='T1')
-        ax.plot(t, T2, 'o:', label='T2')
+        for i, T in enumerate(temperatures):
+            ax.plot(t, T, 'o:', label='T%i' % (i+1))
 
         ax.legend(loc='upper left', bbox_to_anchor=(-0.15, 1))
 
         self.plot_area.canvas.draw()
 
+class BusSignals(QtCore.QObject):
+    '''
+    Defines the signals used to hand MFC replies from the bus thread to the GUI.
+
+    flow
+        str gas, object flow reading
+
+    info
+        str gas, object information string
+
+    baud
+        str port, object baud rate in use
+
+    setpoints
+        str port, dict with invalid setpoints, read back mismatches and skew in ms
+
+    discovered
+        str port, dict of device info by address for every device that answered
+    '''
+    flow = QtCore.pyqtSignal(str, object)
+    info = QtCore.pyqtSignal(str, object)
+    baud = QtCore.pyqtSignal(str, object)
+    setpoints = QtCore.pyqtSignal(str, object)
+    discovered = QtCore.pyqtSignal(str, object)
+
+class TCSignals(QtCore.QObject):
+    '''
+    Defines the signals of the thermocouple background threads.
+
+    fault
+        fault_monitor.FaultEvent
+    '''
+    fault = QtCore.pyqtSignal(object)
+
 class WorkerSignals(QtCore.QObject):
     '''
     Defines the signals available from a running worker thread.
@@ -285,10 +468,70 @@ class Worker(QtCore.QRunnable):
             self.signals.finished.emit()
 
 class RS232Options(QtWidgets.QMainWindow):
-    def __init__(self):
+    """
+    Serial settings. The baud rate of every port is stored, so the ports are opened at the
+    rate the controllers were last switched to
+    """
+    baud_requested = QtCore.pyqtSignal(int)
+
+    def __init__(self, ports):
         super(RS232Options, self).__init__()
         uic.loadUi("ui/RS232Options.ui", self)
 
+        self.ports = ports
+        self.settings = QtCore.QSettings('gas-ui', 'RS232')
+
+        for rate in baud_rates:
+            self.baud_input.addItem(str(rate))
+        self.baud_input.setCurrentText(str(self.baud(self.ports[0])))
+        self.apply_baud_btn.clicked.connect(lambda: self.baud_requested.emit(int(self.baud_input.currentText())))
+
+        self.show_bauds()
+
+    def baud(self, port):
+        return int(self.settings.value(f'baud/{port}', 9600))
+
+    def set_baud(self, port, baud):
+        self.settings.setValue(f'baud/{port}', baud)
+        self.show_bauds()
+
+    def show_bauds(self):
+        self.current_baud.setText('\n'.join([f'{port}: {self.baud(port)} baud' for port in self.ports]))
+
+class BusMetricsDialog(QtWidgets.QMainWindow):
+    """
+    Shows round-trip histograms, byte counts and occupancy of every serial bus, refreshed every second
+    """
+    def __init__(self, bus_manager):
+        super(BusMetricsDialog, self).__init__()
+        uic.loadUi("ui/BusMetrics.ui", self)
+
+        self.bus_manager = bus_manager
+
+        self.timer = QtCore.QTimer()
+        self.timer.timeout.connect(self.update_metrics)
+        self.reset_btn.clicked.connect(self.reset)
+
+    def metrics(self):
+        return {port: bus.mfc.metrics for port, bus in self.bus_manager.buses.items()}
+
+    def update_metrics(self):
+        self.metrics_text.setPlainText('\n\n'.join([f'{port}\n{metrics.report()}' for port, metrics in self.metrics().items()]))
+
+    def reset(self):
+        for metrics in self.metrics().values():
+            metrics.reset()
+        self.update_metrics()
+
+    def showEvent(self, event):
+        self.update_metrics()
+        self.timer.start(1000)
+        super(BusMetricsDialog, self).showEvent(event)
+
+    def hideEvent(self, event):
+        self.timer.stop()
+        super(BusMetricsDialog, self).hideEvent(event)
+
 if __name__ == '__main__':
     app = QtWidgets.QApplication(sys.argv)
     main_window = GasControl()
@@ -1,7 +1,15 @@
-import datetime
 import serial
 import time
-import re
+
+from device_info import get_cache
+from log_sink import get_sink
+from journal import get_journal, ACK, NAK, TIMEOUT, CHECKSUM, GARBLED
+from retry_policy import RetryPolicy
+from readings import get_reading_cache
+from bus_metrics import BusMetrics
+from journal import command_code
+import mks_protocol
+from mks_protocol import baud_rates
 
 error_dict = {'01': 'Checksum error',
               '10': 'Syntax error',
@@ -20,77 +28,332 @@ error_dict = {'01': 'Checksum error',
               '99': 'Internal device error'}
 
 class MFC():
-    def __init__(self, port='/dev/ttyUSB0', baud=9600):
-        self.ser = serial.Serial(port, baud)
+    def __init__(self, port='/dev/ttyUSB0', baud=9600, timeout=0.25, info_cache=None, log_sink=None, journal=None, retry_policy=None, readings=None):
+        # Timeout is the longest we wait for a complete reply frame until the policy has learnt better
+        self.timeout = timeout
+        self.ser = serial.Serial(port, baud, timeout=timeout)
+
+        # Static device properties (serial number, full scale and units)
+        self.info_cache = info_cache if info_cache is not None else get_cache('mfc_info.json')
+
+        # Log records are written to mfc.log on a background thread
+        self.log_sink = log_sink if log_sink is not None else get_sink('mfc.log')
+
+        # Binary record of every transaction - see journal.py
+        self.journal = journal if journal is not None else get_journal('journal', port)
+
+        # Retries, per-address timeouts and degraded devices
+        self.retry_policy = retry_policy if retry_policy is not None else RetryPolicy(initial_timeout=timeout)
 
-    def timestamp(self):
-        current_time = datetime.datetime.now(tz=None)
-        return current_time.strftime("%Y-%m-%d %H:%M:%S")
+        # Latest flow readings, shared with every consumer
+        self.readings = readings if readings is not None else get_reading_cache()
+
+        # Round-trip histograms, byte counts and bus occupancy of this port
+        self.metrics = BusMetrics()
 
     def log(self, log_str, error=False):
-        with open('mfc.log', 'a') as f:
-            if error:
-                f.write("ERROR " + self.timestamp() + " -- " + log_str+"\n")
-            else:
-                f.write(self.timestamp() + " -- " + log_str+"\n")
+        # Only queues the record - timestamp formatting and disk I/O happen in the sink
+        self.log_sink.write(log_str, error=error)
 
     def checksum(self, msg):
-        decimal = sum([ord(s) for s in msg])
-
-        return hex(decimal)[-2:].upper()
+        return mks_protocol.checksum(msg.encode('ascii')).decode('ascii')
 
     def comm(self, cmd, addr):
+        return self.transaction(mks_protocol.encode(cmd, addr), cmd, addr)
+
+    def transaction(self, frame, cmd, addr):
+        """
+        Sends an encoded frame and returns the reply (value, error message or 'N/A').
+        Missing or corrupted replies are retried as the retry policy allows
+        """
+        policy = self.retry_policy
 
-        msg = "@" + str(addr).zfill(3) + cmd + ';'
-        check = self.checksum(msg)
+        for attempt in range(policy.attempts(addr)):
+            # Drop anything left over from an earlier transaction
+            self.ser.reset_input_buffer()
+            start = time.monotonic()
+            self.ser.write(frame)
+            self.log(frame)
 
-        final_msg = "@@" + msg + check
-        self.ser.write(final_msg.encode('utf-8'))
-        self.log(final_msg)
+            status, reply, error_code = self.read_reply(addr, timeout=policy.timeout(addr, attempt))
+            rtt = time.monotonic() - start
+            self.journal.append(start, addr, cmd, rtt, status, error_code)
+            self.metrics.record(addr, command_code(cmd), rtt, len(frame), status)
+            policy.record(addr, status, rtt, error_code)
 
-        time.sleep(.1)
-        reply = self.retrieve_reply(addr)
+            if not policy.should_retry(status, error_code):
+                break
 
+        policy.finished(addr, status, error_code)
         return reply
 
-    def retrieve_reply(self, addr):
-        reply = self.ser.read(self.ser.inWaiting()).decode('utf-8', errors='ignore')
-
-        if 'NAK' in reply:
-            error_code = re.search("NAK(.*);", reply).group(1).strip()
-            return error_dict[error_code]
-        
-        try: 
-            return re.search("ACK(.*);", reply).group(1).strip()
-        
-        except AttributeError:
+    def read_frame(self, timeout=None):
+        """
+        Reads a reply frame up to the ';' terminator and the two checksum characters.
+        Returns the raw bytes or None if the frame is not complete within the timeout
+        """
+        if timeout is None:
+            timeout = self.timeout
+        deadline = time.monotonic() + timeout
+
+        self.ser.timeout = timeout
+        frame = self.ser.read_until(b';')
+        if not frame.endswith(b';'):
+            self.metrics.received(len(frame))
+            return None
+
+        self.ser.timeout = max(deadline - time.monotonic(), 0)
+        frame += self.ser.read(2)
+        self.metrics.received(len(frame))
+
+        if frame[-3:-2] != b';':
+            return None
+        return frame
+
+    def read_reply(self, addr, timeout=None):
+        """
+        Reads the reply of a device.
+        Returns the journal status, the reply (value, error message or 'N/A') and the NAK error code
+        """
+        return self.parse_reply(addr, self.read_frame(timeout), timeout)
+
+    def parse_reply(self, addr, reply, timeout=None):
+        """
+        Parses a reply frame read with read_frame, see read_reply
+        """
+        if reply is None:
+            self.log(f"No complete reply from {addr} within {timeout or self.timeout:.3f} s", error=True)
+            return TIMEOUT, 'N/A', 0
+
+        status, value, error_code = mks_protocol.parse_reply(reply)
+
+        if status == CHECKSUM:
+            self.log(f"Checksum mismatch - reply was {reply}", error=True)
+            return status, 'N/A', 0
+
+        if status == GARBLED:
             self.log(f"Something went wrong - reply was {reply}", error=True)
-            return 'N/A'
-            
+            return status, 'N/A', 0
 
-    def information(self, addr):
-        FS = self.comm('FS?', addr=addr)
-        U = self.comm('U?', addr=addr)
+        if status == NAK:
+            return status, error_dict.get(value, f'Unknown error {value}'), error_code
+
+        return status, value, 0
+
+    def retrieve_reply(self, addr):
+        return self.read_reply(addr)[1]
+
+    def error_statistics(self, addr):
+        """
+        Returns the number of failed attempts of a device per error, NAKs named as in error_dict
+        """
+        stats = self.retry_policy.statistics(addr)
+        names = {TIMEOUT: 'Timeout', CHECKSUM: 'Reply checksum mismatch', GARBLED: 'Garbled reply'}
+
+        counts = {names[status]: n for status, n in stats['errors'].items() if status in names}
+        for code, n in stats['naks'].items():
+            counts[error_dict.get('%02i' % code, f'Unknown error {code}')] = n
+        return counts
+
+
+    def write_burst(self, frames, cmd):
+        """
+        Sends frames (dict by address) back to back, each only waiting for its own reply.
+        Logging, journal and statistics are left until the last reply arrived, so the burst
+        is as short as the bus allows. There are no retries.
+        Returns the replies by address and the time from the first write to the last reply in s
+        """
+        policy = self.retry_policy
+        sent = []
+
+        burst_start = time.monotonic()
+        for addr, frame in frames.items():
+            self.ser.reset_input_buffer()
+            start = time.monotonic()
+            self.ser.write(frame)
+            reply = self.read_frame(policy.timeout(addr))
+            sent.append((addr, frame, start, time.monotonic(), reply))
+        skew = time.monotonic() - burst_start
+
+        replies = {}
+        for addr, frame, start, end, reply in sent:
+            self.log(frame)
+            status, replies[addr], error_code = self.parse_reply(addr, reply, policy.timeout(addr))
+            self.journal.append(start, addr, cmd, end - start, status, error_code)
+            self.metrics.record(addr, command_code(cmd), end - start, len(frame), status)
+            policy.record(addr, status, end - start, error_code)
+            policy.finished(addr, status, error_code)
+
+        return replies, skew
+
+    def device_info(self, addr, refresh=False):
+        """
+        Returns serial number, full scale and units of a device.
+        Only the serial number is asked for if the device is already cached - the rest is
+        read again when the serial number changed or refresh is set
+        """
         SN = self.comm('SN?', addr=addr)
+        info = self.info_cache.get(addr)
+
+        if refresh or info is None or info['SN'] != SN:
+            info = {'SN': SN, 'FS': self.comm('FS?', addr=addr), 'U': self.comm('U?', addr=addr)}
+
+            # Only cache complete answers
+            try:
+                float(info['FS'])
+            except ValueError:
+                return info
+            if SN != 'N/A' and info['U'] != 'N/A':
+                self.info_cache.set(addr, info)
 
-        return "Serial No: #%s\nScale: 0-%s %s" %(SN, FS, U)
+        return info
+
+    def full_scale(self, addr):
+        info = self.info_cache.get(addr)
+        if info is None:
+            info = self.device_info(addr)
+        return float(info['FS'])
+
+    def information(self, addr):
+        info = self.device_info(addr)
+
+        return "Serial No: #%s\nScale: 0-%s %s" %(info['SN'], info['FS'], info['U'])
 
     def set_flow(self, flow, addr):
         """
         Sets flow to specified value in flow controller
         Maybe add validation with 'SX?'
         """
-        upper_limit = float(self.comm('FS?', addr))
+        try:
+            upper_limit = self.full_scale(addr)
+        except ValueError:
+            self.log("Full scale of %s is unknown - flow not set" %addr, error=True)
+            return
+
         flow = round(flow, 2)
 
         if 0 <= flow <= upper_limit:
-            self.comm('SX!%f' %flow, addr)
+            self.transaction(mks_protocol.encode_setpoint(flow, addr), 'SX!', addr)
 
         else:
             self.log("Flow of %f is out of range" %flow, error=True)
 
-    def read_flow(self, addr):
+    def zero_flow(self, addr):
+        """
+        Closes a device's flow without the full scale check of set_flow, so it also reaches a device
+        whose full scale can't be read. Returns whether the device acknowledged it
+        """
+        reply = self.transaction(mks_protocol.encode_setpoint(0, addr), 'SX!', addr)
+        if not self.acknowledged(reply):
+            self.log("Zero flow of %s not acknowledged - reply was %s" %(addr, reply), error=True)
+            return False
+        return True
+
+    def read_flow(self, addr, max_age=None):
+        """
+        Reads the flow of a device. A cached reading younger than max_age (in seconds) is returned
+        without a bus transaction. New readings are published to the reading cache
+        """
+        if max_age is not None:
+            reading = self.readings.get(addr, max_age)
+            if reading is not None:
+                return reading[0]
+
         flow = self.comm('FX?', addr)
+        self.readings.publish(addr, flow)
         return flow
 
+    def probe(self, addr, timeout=0.02):
+        """
+        Checks whether a device answers on an address. Only the first byte of the reply has to
+        arrive within the (short) timeout, counted from when the request has left the port plus its
+        time on the wire - the rest of the frame gets the normal timeout.
+        A late reply would be taken for the answer of the next address, so after a miss the input is
+        dropped once a reply started within the window would have arrived completely.
+        A device that answered still has to be confirmed with a regular transaction (discover does
+        so with device_info)
+        """
+        frame = mks_protocol.encode('SN?', addr)
+        self.ser.reset_input_buffer()
+        start = time.monotonic()
+        self.ser.write(frame)
+        # Blocks until the request is sent, so the timeout doesn't start while it is still queued
+        self.ser.flush()
+        sent = time.monotonic()
+        self.log(f"Probing address {addr}")
+
+        window = timeout + len(frame)*10/self.ser.baudrate
+        self.ser.timeout = window
+        first = self.ser.read(1)
+        if not first:
+            self.metrics.record(addr, 'SN?', time.monotonic() - start, len(frame), TIMEOUT)
+            self.drain(sent + window)
+            return False
+        self.metrics.received(1)
+
+        reply = self.read_frame()
+        if reply is None:
+            self.metrics.record(addr, 'SN?', time.monotonic() - start, len(frame), TIMEOUT)
+            self.drain(sent + window)
+            return False
+        status, _, _ = mks_protocol.parse_reply(first + reply)
+        self.metrics.record(addr, 'SN?', time.monotonic() - start, len(frame), status)
+        if status not in (ACK, NAK):
+            self.drain(sent + window)
+            return False
+        return True
+
+    def drain(self, window_end):
+        # Waits until a reply started before window_end is on the wire completely, then drops it
+        time.sleep(max(0, window_end + mks_protocol.MAX_REPLY_LENGTH*10/self.ser.baudrate - time.monotonic()))
+        self.ser.reset_input_buffer()
+
+    def acknowledged(self, reply):
+        return reply != 'N/A' and reply not in error_dict.values()
+
+    def reopen(self, baud):
+        self.ser.close()
+        self.ser.baudrate = baud
+        self.ser.open()
+
+    def negotiate_baud(self, addrs, baud, settle_time=0.1):
+        """
+        Switches every device on the bus to a new baud rate and reopens the port.
+        Every address has to answer before and after the switch - if one doesn't,
+        the devices already switched are set back and the old rate is kept.
+        Returns the baud rate in use afterwards
+        """
+        old_baud = self.ser.baudrate
+        if baud == old_baud:
+            return old_baud
+        if baud not in baud_rates:
+            raise ValueError(f'{baud} is not a supported baud rate')
+
+        missing = [addr for addr in addrs if not self.acknowledged(self.comm('SN?', addr))]
+        if missing:
+            self.log(f"Baud rate not changed - no reply from {missing}", error=True)
+            return old_baud
+
+        switched = []
+        for addr in addrs:
+            if not self.acknowledged(self.comm('BR!%i' % baud, addr)):
+                break
+            switched.append(addr)
+
+        # Devices answer at the old rate before they switch
+        time.sleep(settle_time)
+        self.reopen(baud)
+
+        missing = [addr for addr in addrs if addr not in switched or not self.acknowledged(self.comm('SN?', addr))]
+        if not missing:
+            self.log(f"Baud rate changed from {old_baud} to {baud}")
+            return baud
+
+        self.log(f"Baud rate change to {baud} failed for {missing} - falling back to {old_baud}", error=True)
+        for addr in switched:
+            self.comm('BR!%i' % old_baud, addr)
+        time.sleep(settle_time)
+        self.reopen(old_baud)
+        return old_baud
+
 
@@ -0,0 +1,119 @@
+"""
+Encoding and parsing of MKS frames on the bytes level.
+
+Request:  @@@<addr><cmd>;<checksum>     e.g. @@@231FX?;EE
+Reply:    @@@<addr>ACK<value>;<checksum> or @@@<addr>NAK<code>;<checksum>
+
+The checksum is the last two hex digits of the sum of the characters from the last '@' of
+the preamble through ';'.
+
+Run this file to benchmark the per-frame cost against the old string based implementation.
+"""
+import re
+
+from journal import ACK, NAK, CHECKSUM, GARBLED
+
+# Baud rates the controllers can be switched to with BR!
+baud_rates = (9600, 19200, 38400, 57600, 115200, 230400)
+
+# Queries without arguments - their frames are encoded once per address
+FIXED_QUERIES = ('FX?', 'FS?', 'SX?', 'SN?', 'U?')
+
+# Longest reply frame in bytes - a serial number or units value is well below 20 characters
+MAX_REPLY_LENGTH = 32
+
+REPLY = re.compile(rb'@@@(\d{3})(ACK|NAK)([^;]*);([0-9A-Fa-f]{2})')
+
+_frames = {}
+_setpoint_prefixes = {}
+
+
+def checksum(body):
+    return b'%02X' % (sum(body) & 0xFF)
+
+
+def encode(cmd, addr):
+    """
+    Returns the complete request frame of a command as bytes
+    """
+    frame = _frames.get((cmd, addr))
+    if frame is not None:
+        return frame
+
+    body = b'@%03i%s;' % (addr, cmd.encode('ascii'))
+    frame = b'@@' + body + checksum(body)
+
+    if cmd in FIXED_QUERIES:
+        _frames[(cmd, addr)] = frame
+    return frame
+
+
+def encode_setpoint(flow, addr):
+    """
+    Returns the SX! frame of a setpoint. Only the value is formatted - the prefix and
+    its part of the checksum are cached per address
+    """
+    try:
+        prefix, prefix_sum = _setpoint_prefixes[addr]
+    except KeyError:
+        prefix = b'@%03iSX!' % addr
+        prefix_sum = sum(prefix) + ord(';')
+        _setpoint_prefixes[addr] = prefix, prefix_sum
+
+    value = b'%f' % flow
+    return b'@@' + prefix + value + b';' + b'%02X' % ((prefix_sum + sum(value)) & 0xFF)
+
+
+def parse_reply(frame):
+    """
+    Parses a reply frame (bytes).
+    Returns (status, value, error code) where value is the ACK value or the NAK code as str
+    """
+    match = REPLY.search(frame)
+    if match is None:
+        return GARBLED, None, 0
+
+    body = frame[match.start()+2:match.end()-2]
+    if checksum(body) != match.group(4).upper():
+        return CHECKSUM, None, 0
+
+    value = match.group(3).strip().decode('ascii', errors='ignore')
+    if match.group(2) == b'NAK':
+        return NAK, value, int(value) if value.isdigit() else 0
+    return ACK, value, 0
+
+
+if __name__ == '__main__':
+    import timeit
+
+    def legacy_encode(cmd, addr):
+        msg = "@" + str(addr).zfill(3) + cmd + ';'
+        check = hex(sum([ord(s) for s in msg]))[-2:].upper()
+        return ("@@" + msg + check).encode('utf-8')
+
+    def legacy_parse(reply):
+        reply = reply.decode('utf-8', errors='ignore')
+        start = reply.rfind('@@@')
+        if hex(sum([ord(s) for s in reply[start+2:-2]]))[-2:].upper() != reply[-2:].upper():
+            return None
+        if 'NAK' in reply:
+            return re.search("NAK(.*);", reply).group(1).strip()
+        return re.search("ACK(.*);", reply).group(1).strip()
+
+    reply = b'@@@000ACK12.34;' + checksum(b'@000ACK12.34;')
+    assert legacy_encode('FX?', 231) == encode('FX?', 231)
+    assert legacy_encode('SX!%f' % 12.5, 231) == encode_setpoint(12.5, 231)
+    assert parse_reply(reply) == (ACK, '12.34', 0)
+
+    n = 200000
+    cases = [
+        ('encode FX? (legacy)', lambda: legacy_encode('FX?', 231)),
+        ('encode FX? (codec)', lambda: encode('FX?', 231)),
+        ('encode SX! (legacy)', lambda: legacy_encode('SX!%f' % 12.5, 231)),
+        ('encode SX! (codec)', lambda: encode_setpoint(12.5, 231)),
+        ('parse ACK (legacy)', lambda: legacy_parse(reply)),
+        ('parse ACK (codec)', lambda: parse_reply(reply)),
+    ]
+    for name, func in cases:
+        t = min(timeit.repeat(func, number=n, repeat=3)) / n
+        print(f'{name:35s} {t*1e6:6.2f} us/frame')
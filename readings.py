@@ -0,0 +1,75 @@
+import itertools
+import threading
+import time
+
+
+class ReadingCache():
+    """
+    Latest flow reading and its time per address.
+    A poll result is published once and handed to every subscriber, and readers accept a cached value
+    up to a maximum age, so bus traffic stays the same however many consumers are attached
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.readings = {}
+        self.subscribers = {}
+        self._ids = itertools.count()
+
+    def publish(self, addr, value, t=None):
+        if t is None:
+            t = time.monotonic()
+
+        with self.lock:
+            self.readings[addr] = (value, t)
+            callbacks = [callback for addrs, callback, _ in self.subscribers.values() if addrs is None or addr in addrs]
+
+        # Called outside the lock, so callbacks may read the cache themselves
+        for callback in callbacks:
+            callback(addr, value, t)
+
+    def get(self, addr, max_age=None):
+        """
+        Returns (value, time) of the latest reading, or None if there is none younger than max_age
+        """
+        with self.lock:
+            reading = self.readings.get(addr)
+
+        if reading is None:
+            return None
+        if max_age is not None and time.monotonic() - reading[1] > max_age:
+            return None
+        return reading
+
+    def subscribe(self, callback, addrs=None, max_age=None):
+        """
+        Calls callback(addr, value, t) for every new reading of the addresses (all if None).
+        max_age is the oldest reading the subscriber accepts - see max_age().
+        Returns an id for unsubscribe
+        """
+        subscription = next(self._ids)
+        with self.lock:
+            self.subscribers[subscription] = (set(addrs) if addrs is not None else None, callback, max_age)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            self.subscribers.pop(subscription, None)
+
+    def max_age(self, addr):
+        """
+        The strictest maximum age any subscriber of an address asked for - the poller has to read
+        the device at least this often. None if nobody asked
+        """
+        with self.lock:
+            ages = [max_age for addrs, _, max_age in self.subscribers.values()
+                    if max_age is not None and (addrs is None or addr in addrs)]
+        return min(ages) if ages else None
+
+
+_cache = ReadingCache()
+
+def get_reading_cache():
+    """
+    The reading cache shared by all MFC connections
+    """
+    return _cache
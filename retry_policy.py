@@ -0,0 +1,117 @@
+import collections
+import threading
+
+from journal import ACK, NAK, TIMEOUT, CHECKSUM, GARBLED
+
+# NAK code sent by the device when our request arrived corrupted
+NAK_CHECKSUM = 1
+
+
+class DeviceStats():
+    def __init__(self):
+        self.srtt = None
+        self.rttvar = 0
+        self.failures = 0
+        self.degraded = False
+        self.skipped_polls = 0
+        # Counts per status, and per error code for NAKs
+        self.errors = collections.Counter()
+        self.naks = collections.Counter()
+
+
+class RetryPolicy():
+    """
+    Per-device retry and timeout policy for MFC transactions.
+    The reply timeout of each address is learnt from its round-trip times (like TCP: smoothed mean
+    plus four times the mean deviation) and doubled on every retry. Corrupted or missing replies are
+    retried a bounded number of times. A device failing degrade_after transactions in a row is marked
+    degraded - it is then tried without retries and polled only every degraded_interval cycles,
+    so a dead controller doesn't stall the whole bus
+    """
+    def __init__(self, retries=2, initial_timeout=0.25, min_timeout=0.02, max_timeout=1.0,
+                 degrade_after=3, degraded_interval=6):
+        self.retries = retries
+        self.initial_timeout = initial_timeout
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.degrade_after = degrade_after
+        self.degraded_interval = degraded_interval
+
+        self.lock = threading.Lock()
+        self.devices = collections.defaultdict(DeviceStats)
+
+    def attempts(self, addr):
+        with self.lock:
+            return 1 if self.devices[addr].degraded else self.retries + 1
+
+    def timeout(self, addr, attempt=0):
+        with self.lock:
+            stats = self.devices[addr]
+            if stats.srtt is None:
+                timeout = self.initial_timeout
+            else:
+                timeout = stats.srtt + 4*stats.rttvar
+        timeout = max(self.min_timeout, min(timeout, self.max_timeout))
+        return min(timeout * 2**attempt, self.max_timeout)
+
+    def should_retry(self, status, error_code=0):
+        return status in (TIMEOUT, CHECKSUM, GARBLED) or (status == NAK and error_code == NAK_CHECKSUM)
+
+    def record(self, addr, status, rtt, error_code=0):
+        """
+        Records the outcome of a single attempt
+        """
+        with self.lock:
+            stats = self.devices[addr]
+
+            if status in (ACK, NAK):
+                # The device answered, so the round-trip time is a real sample
+                if stats.srtt is None:
+                    stats.srtt, stats.rttvar = rtt, rtt/2
+                else:
+                    stats.rttvar = 0.75*stats.rttvar + 0.25*abs(stats.srtt - rtt)
+                    stats.srtt = 0.875*stats.srtt + 0.125*rtt
+
+            if status != ACK:
+                stats.errors[status] += 1
+            if status == NAK:
+                stats.naks[error_code] += 1
+
+    def finished(self, addr, status, error_code=0):
+        """
+        Records the outcome of a whole transaction (after retries)
+        """
+        with self.lock:
+            stats = self.devices[addr]
+            if status in (ACK, NAK) and not (status == NAK and error_code == NAK_CHECKSUM):
+                stats.failures = 0
+                stats.degraded = False
+            else:
+                stats.failures += 1
+                if stats.failures >= self.degrade_after:
+                    stats.degraded = True
+
+    def is_degraded(self, addr):
+        with self.lock:
+            return self.devices[addr].degraded
+
+    def should_poll(self, addr):
+        """
+        Called once per poll cycle - degraded devices are only polled every degraded_interval cycles
+        """
+        with self.lock:
+            stats = self.devices[addr]
+            if not stats.degraded:
+                return True
+
+            stats.skipped_polls += 1
+            if stats.skipped_polls >= self.degraded_interval:
+                stats.skipped_polls = 0
+                return True
+            return False
+
+    def statistics(self, addr):
+        with self.lock:
+            stats = self.devices[addr]
+            return {'srtt': stats.srtt, 'rttvar': stats.rttvar, 'degraded': stats.degraded,
+                    'errors': dict(stats.errors), 'naks': dict(stats.naks)}
@@ -0,0 +1,220 @@
+"""
+Memory-mapped columnar run format for measurement data.
+
+A run file starts with a fixed header followed by one preallocated float64 column per channel:
+
+    magic     4 bytes   b'MRUN'
+    version   uint16
+    columns   uint16    number of columns
+    capacity  uint64    rows allocated per column
+    rows      uint64    rows written - only increased after the data is in place
+    names     json      column names and dtypes, padded to HEADER_SIZE
+
+Column i starts at HEADER_SIZE + i*capacity*8. Appending copies the rows into the mapped columns,
+and a full file doubles its capacity, moving the columns back to front. The first column is the
+time in seconds and only grows, so readers can cut out a time range with zero-copy views.
+
+Export to the tab-separated text of the other measurement files, e.g. one afternoon:
+    python runfile.py run.000.run --tsv run.txt --start "2026-10-18 12:00" --end "2026-10-18 18:00"
+"""
+import argparse
+import datetime
+import json
+import mmap
+import struct
+import time
+
+import numpy as np
+
+MAGIC = b'MRUN'
+VERSION = 1
+# magic, version, columns, capacity, rows
+HEADER = struct.Struct('<4sHHQQ')
+HEADER_SIZE = 4096
+CAPACITY_OFFSET = 8
+ROWS_OFFSET = 16
+DTYPE = np.dtype('<f8')
+
+
+class RunWriter():
+    """
+    Appends rows to a run file through a shared memory map. The row count in the header is updated
+    after every write, so readers always see complete rows. The mapped pages are written back by
+    the OS, and msync'ed every fsync_interval seconds and on close (None never syncs) - the same
+    guarantee as writer.MeasurementWriter gives after a flush
+    """
+    def __init__(self, filename, header, capacity=4096, fsync_interval=10.0):
+        self.filename = filename
+        self.header = list(header)
+        self.columns = len(self.header)
+        self.capacity = capacity
+        self.count = 0
+        self.fsync_interval = fsync_interval
+        self.last_fsync = time.monotonic()
+
+        names = json.dumps({'names': self.header, 'dtypes': [DTYPE.str] * self.columns}).encode('utf-8')
+        if HEADER.size + len(names) > HEADER_SIZE:
+            raise ValueError('Too many or too long column names for a run file')
+
+        self.file = open(filename, 'w+b')
+        self.file.write((HEADER.pack(MAGIC, VERSION, self.columns, capacity, 0) + names).ljust(HEADER_SIZE, b'\0'))
+        self.file.truncate(self.file_size(capacity))
+        self.map()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def closed(self):
+        return self.file.closed
+
+    @property
+    def size(self):
+        return HEADER_SIZE + self.count * self.columns * DTYPE.itemsize
+
+    def file_size(self, capacity):
+        return HEADER_SIZE + self.columns * capacity * DTYPE.itemsize
+
+    def map(self):
+        self.mm = mmap.mmap(self.file.fileno(), self.file_size(self.capacity))
+        self.rows = np.frombuffer(self.mm, dtype='<u8', count=1, offset=ROWS_OFFSET)
+        self.data = np.frombuffer(self.mm, dtype=DTYPE, offset=HEADER_SIZE).reshape(self.columns, self.capacity)
+
+    def unmap(self):
+        # The arrays hold exports of the map, which must be gone before it can be closed
+        del self.rows, self.data
+        self.mm.close()
+
+    def grow(self, needed):
+        old = self.capacity
+        while self.capacity < needed:
+            self.capacity *= 2
+
+        self.unmap()
+        self.file.truncate(self.file_size(self.capacity))
+        self.map()
+
+        # Every column moves to a higher offset - the last first, so none is overwritten before it moved
+        flat = self.data.reshape(-1)
+        for i in range(self.columns - 1, 0, -1):
+            flat[i*self.capacity:i*self.capacity + self.count] = flat[i*old:i*old + self.count]
+
+        # The moved columns don't overlap their old place, so until here the file is still valid with the old capacity
+        struct.pack_into('<Q', self.mm, CAPACITY_OFFSET, self.capacity)
+
+    def write(self, row):
+        self.write_rows([row])
+
+    def write_rows(self, rows):
+        rows = np.asarray(rows, dtype=DTYPE).reshape(-1, self.columns)
+        n = len(rows)
+        if n == 0:
+            return
+        if self.count + n > self.capacity:
+            self.grow(self.count + n)
+
+        self.data[:, self.count:self.count + n] = rows.T
+        self.count += n
+        self.rows[0] = self.count
+
+        if self.fsync_interval is not None and time.monotonic() - self.last_fsync >= self.fsync_interval:
+            self.flush(fsync=True)
+
+    def flush(self, fsync=False):
+        if fsync:
+            self.mm.flush()
+            self.last_fsync = time.monotonic()
+
+    def close(self):
+        if self.file.closed:
+            return
+        self.flush(fsync=self.fsync_interval is not None)
+        self.unmap()
+        self.file.close()
+
+
+class RunFile():
+    """
+    Read-only memory-mapped view of a run file. Rows appended after opening are not seen
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            header = f.read(HEADER_SIZE)
+
+        magic, version, columns, capacity, rows = HEADER.unpack_from(header)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f'{path} is not a run file (version {VERSION})')
+
+        info = json.loads(header[HEADER.size:].rstrip(b'\0').decode('utf-8'))
+        self.names = info['names']
+        self.dtypes = [np.dtype(dtype) for dtype in info['dtypes']]
+
+        if rows > 0:
+            data = np.memmap(path, dtype=DTYPE, mode='r', offset=HEADER_SIZE, shape=(columns, capacity))
+            self.data = data[:, :rows]
+        else:
+            self.data = np.zeros((columns, 0), dtype=DTYPE)
+
+    def __len__(self):
+        return self.data.shape[1]
+
+    def column(self, name):
+        return self.data[self.names.index(name)]
+
+    def select(self, start=None, end=None):
+        """
+        Returns a zero-copy view (rows, columns) of the rows between two times in seconds
+        """
+        t = self.data[0]
+        lo = 0 if start is None else np.searchsorted(t, start, 'left')
+        hi = len(t) if end is None else np.searchsorted(t, end, 'right')
+        return self.data[:, lo:hi].T
+
+    def export_tsv(self, path, start=None, end=None):
+        """
+        Writes the rows as tab-separated text with a header line, like writer.MeasurementWriter
+        """
+        rows = self.select(start, end)
+        with open(path, 'w') as f:
+            f.write('\t'.join(self.names) + '\n')
+            np.savetxt(f, rows, fmt='%.17g', delimiter='\t')
+
+
+def load(path):
+    """
+    Returns the rows of a measurement file (rows, columns), whether text or run file
+    """
+    if path.endswith('.run'):
+        return RunFile(path).select()
+    return np.loadtxt(path, delimiter='\t', skiprows=1, ndmin=2)
+
+
+def parse_time(text):
+    return datetime.datetime.fromisoformat(text).timestamp()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Inspect or export a measurement run file')
+    parser.add_argument('path')
+    parser.add_argument('--tsv', help='export to this text file')
+    parser.add_argument('--start', type=parse_time, help='e.g. "2026-10-18 12:00:00"')
+    parser.add_argument('--end', type=parse_time)
+    args = parser.parse_args()
+
+    run = RunFile(args.path)
+    if args.tsv:
+        run.export_tsv(args.tsv, args.start, args.end)
+        return
+
+    print(f'{len(run)} rows of {", ".join(run.names)}')
+    if len(run):
+        t = run.data[0]
+        print(f'{datetime.datetime.fromtimestamp(t[0])} - {datetime.datetime.fromtimestamp(t[-1])}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+import queue
+import threading
+import time
+
+import numpy as np
+
+from scheduler import Clock, FixedRateScheduler
+
+
+class RingBuffer():
+    """
+    Fixed-size buffer of timestamped samples for one writer and any number of readers.
+    Readers never take a lock - the sample counter is only increased after a row is written,
+    and a read is repeated if the writer overwrote the rows while they were copied. The slot the
+    next push writes is never read, so at most capacity - 1 samples are available
+    """
+    def __init__(self, capacity, channels):
+        self.capacity = capacity
+        self.t = np.zeros(capacity)
+        self.values = np.full((capacity, channels), np.nan)
+        self.count = 0
+
+    def __len__(self):
+        return min(self.count, self.capacity - 1)
+
+    def push(self, t, values):
+        i = self.count % self.capacity
+        self.t[i] = t
+        self.values[i] = values
+        self.count += 1
+
+    def latest(self):
+        """
+        Returns (t, values) of the newest sample, or None if there is none yet
+        """
+        t, values = self.history(1)
+        if len(t) == 0:
+            return None
+        return t[0], values[0]
+
+    def history(self, n=None):
+        """
+        Returns copies (t, values) of the last n samples (all buffered if None), oldest first
+        """
+        return self._read(n)[:2]
+
+    def since(self, count):
+        """
+        Returns copies (t, values) of the samples pushed after the buffer held count samples,
+        and the new count to pass next time. Samples already overwritten are skipped
+        """
+        return self._read(None, count)
+
+    def _read(self, n=None, since=0):
+        while True:
+            count = self.count
+            available = min(count - since, self.capacity - 1)
+            n_read = available if n is None else min(n, available)
+
+            idx = np.arange(count - n_read, count) % self.capacity
+            t, values = self.t[idx], self.values[idx]
+
+            # The oldest rows read must not have been overwritten while copying
+            if self.count - count < self.capacity - n_read:
+                return t, values, count
+
+
+class TCSampler(threading.Thread):
+    """
+    Runs the thermocouple chips in continuous-conversion mode and reads them once per conversion
+    period into a ring buffer, so consumers get the latest value or a block of history without SPI.
+    Samples are stamped with self.clock - wall-clock seconds that advance with the monotonic clock
+    """
+    def __init__(self, tcs, capacity=36000, period=None):
+        super(TCSampler, self).__init__(daemon=True)
+        self.tcs = tcs
+        self.period = period if period is not None else tcs.conversion_time()
+        self.buffer = RingBuffer(capacity, len(tcs))
+        self.clock = Clock()
+        self.scheduler = FixedRateScheduler(1 / self.period, clock=self.clock)
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+    def latest(self):
+        return self.buffer.latest()
+
+    def history(self, n=None):
+        return self.buffer.history(n)
+
+    def since(self, count):
+        return self.buffer.since(count)
+
+    def run(self):
+        self.tcs.start_continuous()
+        try:
+            # Starts the schedule - the first conversion is done one period later
+            self.scheduler.wait()
+            while not self.scheduler.wait(self._stop_event):
+                self.buffer.push(self.clock.wall(), self.tcs.read_T())
+        finally:
+            self.tcs.stop_continuous()
+
+
+class DrdySampler(TCSampler):
+    """
+    Reads the chips when their conversions are done instead of on a timer. A falling edge on the
+    DRDY line of a chip marks a new conversion - once every chip has one, all are read in a single
+    scan and the sample is stamped with the time of the last edge. If a DRDY edge is missing for
+    two conversion periods, the chips are read anyway and the miss is counted
+    """
+    def __init__(self, tcs, gpio, drdy_pins, capacity=36000):
+        super(DrdySampler, self).__init__(tcs, capacity)
+        self.gpio = gpio
+        self.drdy_pins = list(drdy_pins)
+        self.edges = queue.Queue()
+        self.missed = 0
+
+    def on_edge(self, pin):
+        # Runs on the GPIO callback thread
+        self.edges.put((self.clock.wall(), pin))
+
+    def run(self):
+        self.gpio.setup(self.drdy_pins, self.gpio.IN, pull_up_down=self.gpio.PUD_UP)
+        for pin in self.drdy_pins:
+            self.gpio.add_event_detect(pin, self.gpio.FALLING, callback=self.on_edge)
+
+        self.tcs.start_continuous()
+        try:
+            ready = {}
+            deadline = time.monotonic() + 2*self.period
+            while not self._stop_event.is_set():
+                try:
+                    t, pin = self.edges.get(timeout=max(0, min(deadline - time.monotonic(), 0.5)))
+                    ready[pin] = t
+                except queue.Empty:
+                    pass
+
+                if len(ready) == len(self.drdy_pins):
+                    self.buffer.push(max(ready.values()), self.tcs.read_T())
+                elif time.monotonic() >= deadline:
+                    self.missed += 1
+                    self.buffer.push(self.clock.wall(), self.tcs.read_T())
+                else:
+                    continue
+
+                ready = {}
+                deadline = time.monotonic() + 2*self.period
+        finally:
+            for pin in self.drdy_pins:
+                self.gpio.remove_event_detect(pin)
+            self.tcs.stop_continuous()
@@ -0,0 +1,72 @@
+import math
+import time
+
+
+class Clock():
+    """
+    High-resolution monotonic clock anchored to the wall clock once at creation.
+    wall() gives wall-clock seconds that advance with the monotonic clock, so time stamps within
+    a run are evenly spaced and never jump when the system time is adjusted
+    """
+    def __init__(self):
+        self.wall_anchor = time.time()
+        self.monotonic_anchor = time.perf_counter()
+
+    def monotonic(self):
+        return time.perf_counter()
+
+    def wall(self, t=None):
+        """
+        Wall-clock time of the monotonic time t (now if None)
+        """
+        if t is None:
+            t = time.perf_counter()
+        return self.wall_anchor + (t - self.monotonic_anchor)
+
+
+class FixedRateScheduler():
+    """
+    Fires at absolute deadlines start + n/rate of the monotonic clock, so the period doesn't drift
+    with the time the work between ticks takes. A deadline that already passed when wait is called
+    is counted as missed. With catch_up the late ticks fire at once until the schedule is met again,
+    otherwise they are skipped and the next tick is the next deadline in the future
+    """
+    def __init__(self, rate, catch_up=False, clock=None):
+        self.period = 1 / rate
+        self.catch_up = catch_up
+        self.clock = clock if clock is not None else Clock()
+
+        self.start = None
+        self.tick = 0
+        self.missed = 0
+
+    def deadline(self):
+        return self.start + self.tick*self.period
+
+    def wait(self, stop=None):
+        """
+        Sleeps until the next deadline - the first call fires at once and starts the schedule.
+        stop is anything with a wait(timeout) method returning True when woken early, like a
+        threading.Event or a MeasurementSession. Returns True if stopped, else False
+        """
+        now = self.clock.monotonic()
+        if self.start is None:
+            self.start = now
+            return False
+
+        self.tick += 1
+        late = now - self.deadline()
+        if late > 0:
+            if self.catch_up:
+                self.missed += 1
+                return stop is not None and stop.wait(0)
+
+            skipped = math.floor(late / self.period) + 1
+            self.missed += skipped
+            self.tick += skipped
+
+        timeout = max(0, self.deadline() - self.clock.monotonic())
+        if stop is None:
+            time.sleep(timeout)
+            return False
+        return stop.wait(timeout)
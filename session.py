@@ -0,0 +1,58 @@
+import threading
+
+IDLE = 'idle'
+RUNNING = 'running'
+STOPPING = 'stopping'
+DONE = 'done'
+
+
+class MeasurementSession():
+    """
+    Run state of a measurement, shared between the GUI and the measurement thread.
+    idle -> running -> (stopping ->) done, and done -> running for the next measurement.
+    Stopping sets an event, so a measurement waiting between samples wakes up at once
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self._state = IDLE
+        self._stop_event = threading.Event()
+
+    @property
+    def state(self):
+        with self.lock:
+            return self._state
+
+    def start(self):
+        """
+        Returns False if a measurement is already running
+        """
+        with self.lock:
+            if self._state in (RUNNING, STOPPING):
+                return False
+            self._state = RUNNING
+            self._stop_event.clear()
+            return True
+
+    def stop(self):
+        with self.lock:
+            if self._state == RUNNING:
+                self._state = STOPPING
+                self._stop_event.set()
+
+    def finish(self):
+        with self.lock:
+            self._state = DONE
+            self._stop_event.set()
+
+    def is_running(self):
+        with self.lock:
+            return self._state in (RUNNING, STOPPING)
+
+    def stop_requested(self):
+        return self._stop_event.is_set()
+
+    def wait(self, timeout):
+        """
+        Sleeps for timeout seconds or until stop is requested. Returns True if stop was requested
+        """
+        return self._stop_event.wait(timeout)
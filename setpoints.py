@@ -0,0 +1,79 @@
+import mks_protocol
+
+
+class SetpointManager():
+    """
+    Remembers the last setpoint every flow controller acknowledged, so only changed setpoints are
+    written. All values are checked against the cached full scale before anything is sent, then the
+    changed setpoints go out in one burst, so the reactor sees the old and the new mixture for as
+    short a time as possible. Written setpoints are read back with SX? afterwards
+    """
+    def __init__(self, mfc, tolerance=0.005):
+        self.mfc = mfc
+        self.tolerance = tolerance
+        self.acknowledged = {}
+
+    def changed(self, setpoints):
+        changed = {}
+        for addr, flow in setpoints.items():
+            flow = round(flow, 2)
+            last = self.acknowledged.get(addr)
+            if last is None or abs(last - flow) > self.tolerance:
+                changed[addr] = flow
+        return changed
+
+    def invalid(self, setpoints):
+        invalid = {}
+        for addr, flow in setpoints.items():
+            try:
+                upper_limit = self.mfc.full_scale(addr)
+            except ValueError:
+                invalid[addr] = (flow, 'full scale unknown')
+                continue
+            if not 0 <= flow <= upper_limit:
+                invalid[addr] = (flow, f'out of range 0-{upper_limit}')
+        return invalid
+
+    def apply(self, setpoints):
+        """
+        setpoints is a dict of flows by address. Nothing is sent if any value is invalid.
+        Returns a dict with
+            invalid     (flow, reason) by address of values that failed validation
+            mismatches  (requested flow, read back value) by address
+            skew        ms between the first setpoint write and the last acknowledgement
+        """
+        result = {'invalid': self.invalid(setpoints), 'mismatches': {}, 'skew': 0.0}
+        if result['invalid']:
+            return result
+
+        changed = self.changed(setpoints)
+        if not changed:
+            return result
+
+        frames = {addr: mks_protocol.encode_setpoint(flow, addr) for addr, flow in changed.items()}
+        _, skew = self.mfc.write_burst(frames, 'SX!')
+        result['skew'] = 1000 * skew
+
+        for addr, flow in changed.items():
+            reply = self.mfc.comm('SX?', addr)
+            try:
+                value = float(reply)
+            except (TypeError, ValueError):
+                value = None
+
+            if value is None or abs(value - flow) > self.tolerance:
+                result['mismatches'][addr] = (flow, reply)
+                self.acknowledged.pop(addr, None)
+            else:
+                self.acknowledged[addr] = value
+
+        return result
+
+    def forget(self, addr=None):
+        """
+        Makes the next apply write a device (or all devices) again
+        """
+        if addr is None:
+            self.acknowledged.clear()
+        else:
+            self.acknowledged.pop(addr, None)
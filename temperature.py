@@ -1,24 +1,60 @@
+import threading
+import time
+
 import board
 import digitalio
 import adafruit_max31856
+import numpy as np
+
+# Configuration register 0 of the MAX31856
+CR0_REG = 0x00
+CR0_AUTOCONVERT = 0x80
+CR0_1SHOT = 0x40
+
+# Conversion time in continuous mode (1 sample averaging) for 50 and 60 Hz noise rejection, datasheet table 6
+CONVERSION_TIME = {50: 0.0983, 60: 0.0823}
+
+# Linearized thermocouple temperature, 3 bytes starting at LTCBH
+LTCBH_REG = 0x0C
+
+# Fault status register - decoded by fault_monitor.decode_faults
+SR_REG = 0x0F
+
+# Same SPI settings as adafruit_max31856 uses
+SPI_BAUDRATE = 500000
+SPI_PHASE = 1
 
 class TC():
     """
     Class that handles the SPI driven thermocouple amplifier from Adafruit (MAX 31856)
     """
-    def __init__(self, CS_PINS, tc_type='N'):
+    def __init__(self, CS_PINS, tc_type='N', drdy_pins=None):
         self.CS_PINS = CS_PINS
 
+        # GPIO (BCM) pins wired to the DRDY outputs, if any - see sampler.DrdySampler
+        self.drdy_pins = drdy_pins
+
         spi = board.SPI()
+        self.spi = spi
 
         cs = [digitalio.DigitalInOut(getattr(board, pin)) for pin in self.CS_PINS]
         for c in cs:
             c.direction = digitalio.Direction.OUTPUT
+        self.cs = cs
 
         self.tcs = [adafruit_max31856.MAX31856(spi, c, thermocouple_type=getattr(adafruit_max31856.ThermocoupleType, tc_type)) for c in cs]
+        self.noise_rejection = 50
         for tc in self.tcs:
-             tc.noise_rejection = 50
+             tc.noise_rejection = self.noise_rejection
+
+        self.continuous = False
+
+        # Only one batched transaction at a time - the sampler and the fault monitor share the bus
+        self.lock = threading.Lock()
 
+        # Register buffers of all chips, reused by every read
+        self._buffers = {}
+        self.scan_time = None
 
     def __len__(self):
         return len(self.tcs)
@@ -26,18 +62,88 @@ class TC():
     def initiate(self):
         [tc.initiate_one_shot_measurement() for tc in self.tcs]
 
+    def start_continuous(self):
+        """
+        Puts every chip in automatic conversion mode - a new temperature is ready every conversion_time()
+        """
+        with self.lock:
+            for tc in self.tcs:
+                cr0 = tc._read_register(CR0_REG, 1)[0]
+                tc._write_u8(CR0_REG, (cr0 | CR0_AUTOCONVERT) & ~CR0_1SHOT)
+        self.continuous = True
+
+    def stop_continuous(self):
+        with self.lock:
+            for tc in self.tcs:
+                cr0 = tc._read_register(CR0_REG, 1)[0]
+                tc._write_u8(CR0_REG, cr0 & ~CR0_AUTOCONVERT)
+        self.continuous = False
+
+    def conversion_time(self):
+        return CONVERSION_TIME[self.noise_rejection]
+
+    def read_registers(self, address, length):
+        """
+        Reads the same registers of all chips back to back while holding the SPI bus once.
+        Returns a (chips, length) uint8 array
+        """
+        key = (address, length)
+        if key not in self._buffers:
+            self._buffers[key] = (bytes([address]), bytearray(length*len(self.cs)))
+        cmd, buffer = self._buffers[key]
+
+        with self.lock:
+            while not self.spi.try_lock():
+                pass
+            try:
+                self.spi.configure(baudrate=SPI_BAUDRATE, phase=SPI_PHASE)
+                for i, cs in enumerate(self.cs):
+                    cs.value = False
+                    self.spi.write(cmd)
+                    self.spi.readinto(buffer, start=length*i, end=length*(i + 1))
+                    cs.value = True
+            finally:
+                self.spi.unlock()
+
+            return np.frombuffer(buffer, dtype=np.uint8).reshape(-1, length).copy()
+
+    def scan(self):
+        """
+        Reads the temperature of all chips with one register transaction each.
+        Returns the temperatures in degC as a NumPy array - the time it took is kept in scan_time
+        """
+        start = time.perf_counter()
+
+        # 19 bit two's complement, 1/128 degC per bit - decoded for all chips at once
+        raw = self.read_registers(LTCBH_REG, 3).astype(np.int32)
+        counts = ((raw[:, 0] << 24) | (raw[:, 1] << 16) | (raw[:, 2] << 8)) >> 13
+
+        self.scan_time = time.perf_counter() - start
+        return counts / 128
+
+    def read_T(self):
+        """
+        Reads the last converted temperature of every chip without checking for a pending conversion
+        """
+        return self.scan()
+
+    def read_faults(self):
+        """
+        Reads the fault status register of every chip. Returns a uint8 array - see fault_monitor.decode_faults
+        """
+        return self.read_registers(SR_REG, 1)[:, 0]
+
     def get_T(self):
         # [tc.initiate_one_shot_measurement() for tc in self.tcs]
 
         # while self.tcs[-1].oneshot_pending:
             # pass
 
-        print(self.tcs[0].fault)
-
+        # Faults are watched by fault_monitor.FaultMonitor - not on every sample
 
-        if self.tcs[0].oneshot_pending:
+        if not self.continuous and self.tcs[0].oneshot_pending:
             raise Exception('Temperature not initialised!')
-        return [tc.unpack_temperature() for tc in self.tcs]
+        return self.read_T()
 
     def set_type(self, tc_type='N'):
         thermocouple_type = getattr(adafruit_max31856.ThermocoupleType, tc_type)
@@ -0,0 +1,170 @@
+import json
+import os
+import time
+
+from runfile import RunWriter
+
+
+class MeasurementWriter():
+    """
+    Keeps a measurement file open and collects rows in memory instead of opening the file per sample.
+
+    Durability: buffered rows are handed to the OS when flush_rows rows are waiting, when
+    flush_interval seconds passed since the last flush, and on close. Every fsync_interval seconds
+    (and on close) the file is also fsynced. A crash of the program therefore loses at most the last
+    flush_interval seconds of rows, and a power cut at most flush_interval + fsync_interval seconds.
+    fsync_interval=0 fsyncs on every flush, None never fsyncs
+    """
+    def __init__(self, filename, header=None, flush_rows=1000, flush_interval=1.0, fsync_interval=10.0):
+        self.filename = filename
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.fsync_interval = fsync_interval
+
+        self.file = open(filename, 'w')
+        self.rows = []
+        # Bytes written including the buffered rows
+        self.size = 0
+        self.last_flush = self.last_fsync = time.monotonic()
+
+        if header is not None:
+            line = '\t'.join(header) + '\n'
+            self.rows.append(line)
+            self.size += len(line)
+            self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def closed(self):
+        return self.file.closed
+
+    def write(self, row):
+        line = '\t'.join(list(map(str, row))) + '\n'
+        self.rows.append(line)
+        self.size += len(line)
+
+        if len(self.rows) >= self.flush_rows or time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def write_rows(self, rows):
+        for row in rows:
+            self.write(row)
+
+    def flush(self, fsync=False):
+        if self.rows:
+            self.file.write(''.join(self.rows))
+            self.rows = []
+        self.file.flush()
+
+        now = time.monotonic()
+        self.last_flush = now
+
+        if self.fsync_interval is not None and (fsync or now - self.last_fsync >= self.fsync_interval):
+            os.fsync(self.file.fileno())
+            self.last_fsync = now
+
+    def close(self):
+        if self.file.closed:
+            return
+        self.flush(fsync=self.fsync_interval is not None)
+        self.file.close()
+
+
+class ChunkedWriter():
+    """
+    Splits a measurement into chunk files of at most max_bytes or max_seconds each (None for no limit):
+    run.txt is written as run.000.txt, run.001.txt and so on, every chunk with the header, and
+    run.manifest.json lists the chunks with their rows and start and end times.
+    The manifest is replaced atomically whenever a chunk is opened or closed, so after a crash it
+    still lists every chunk - only the last one, with no end time, may miss its unflushed rows.
+    A filename ending in .run writes run files (see runfile.RunWriter), anything else text.
+    The other arguments are passed on to the writer of the chunks
+    """
+    def __init__(self, filename, header=None, max_bytes=50*1024*1024, max_seconds=3600, **kwargs):
+        self.root = os.path.splitext(filename)[0]
+        self.ext = os.path.splitext(filename)[1] or '.txt'
+        self.header = header
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        self.kwargs = kwargs
+
+        self.manifest_path = manifest_path(filename)
+        self.chunks = []
+        self.chunk = None
+        self.open_chunk()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def filename(self):
+        return self.chunk.filename
+
+    def open_chunk(self):
+        filename = f'{self.root}.{len(self.chunks):03d}{self.ext}'
+        writer = RunWriter if self.ext == '.run' else MeasurementWriter
+        self.chunk = writer(filename, self.header, **self.kwargs)
+        self.chunk_start = time.monotonic()
+        self.chunks.append({'file': os.path.basename(filename), 'rows': 0, 'start': time.time(), 'end': None})
+        self.save_manifest()
+
+    def close_chunk(self):
+        self.chunk.close()
+        self.chunks[-1]['end'] = time.time()
+        self.save_manifest()
+
+    def write(self, row):
+        self.chunk.write(row)
+        self.chunks[-1]['rows'] += 1
+
+        if ((self.max_bytes is not None and self.chunk.size >= self.max_bytes)
+                or (self.max_seconds is not None and time.monotonic() - self.chunk_start >= self.max_seconds)):
+            self.close_chunk()
+            self.open_chunk()
+
+    def write_rows(self, rows):
+        for row in rows:
+            self.write(row)
+
+    def flush(self, fsync=False):
+        self.chunk.flush(fsync)
+
+    def close(self):
+        if self.chunk.closed:
+            return
+        self.close_chunk()
+
+    def save_manifest(self):
+        manifest = {'header': self.header, 'chunks': self.chunks}
+
+        # Write to a temporary file first so a crash never leaves half a manifest behind
+        tmp_path = self.manifest_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+
+
+def manifest_path(filename):
+    return os.path.splitext(filename)[0] + '.manifest.json'
+
+
+def read_manifest(filename):
+    """
+    Returns the manifest of a chunked measurement, with the chunk paths next to the manifest
+    """
+    path = manifest_path(filename)
+    with open(path, 'r') as f:
+        manifest = json.load(f)
+
+    directory = os.path.dirname(path)
+    for chunk in manifest['chunks']:
+        chunk['path'] = os.path.join(directory, chunk['file'])
+    return manifest